@@ -15,7 +15,6 @@ requires = (
     'voteit.core',
     'voteit.irl',
     'typing',
-    'zope.copy',
 )
 
 
@@ -38,6 +37,9 @@ setup(
     include_package_data=True,
     zip_safe=False,
     install_requires=requires,
+    extras_require={
+        'xlsx': ['openpyxl'],
+    },
     tests_require=requires,
     license='GPL',
     test_suite="voteit.vote_groups",
@@ -11,4 +11,5 @@ def includeme(config):
     config.include('.models')
     config.include('.schemas')
     config.include('.evolve')
+    config.include('.instrumentation')
     config.add_translation_dirs('voteit.vote_groups:locale/')
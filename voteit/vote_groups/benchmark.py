@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+""" Benchmarks for vote groups, run against an in-memory ZODB.
+
+Usage::
+
+    python -m voteit.vote_groups.benchmark --groups 10,100,500 --members 5,20,100 --output result.json
+
+Results are written as JSON, one entry per operation and meeting size, so runs from
+different commits can be compared. Concurrent assign and release against a FileStorage
+is measured with::
+
+    python -m voteit.vote_groups.benchmark --stress 8
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import transaction
+from pyramid import testing
+from pyramid.renderers import render
+from pyramid.request import apply_request_extensions
+from ZODB import DB
+from voteit.core import security
+from voteit.core.models.interfaces import IMeeting
+from voteit.core.testing_helpers import bootstrap_and_fixture
+from voteit.irl.models.interfaces import IMeetingPresence
+from zope.interface import implementer
+
+from voteit.vote_groups.interfaces import IVoteGroups
+from voteit.vote_groups.interfaces import ROLE_PRIMARY
+from voteit.vote_groups.interfaces import ROLE_STANDIN
+
+
+DEFAULT_GROUPS = (10, 100, 500)
+DEFAULT_MEMBERS = (5, 20, 100)
+
+
+@implementer(IMeetingPresence)
+class _FixedPresence(object):
+    """ Every other member is checked in. Presence itself isn't what's measured here. """
+
+    def __init__(self, meeting):
+        self.present_userids = frozenset(meeting._benchmark_present)
+
+
+def _csv_ints(value):
+    return tuple(int(x) for x in value.split(',') if x.strip())
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip().decode('ascii')
+    except Exception:  # pragma: no cover
+        return None
+
+
+class BenchmarkFixture(object):
+    """ A site with one meeting, populated with groups * members synthetic users.
+        In every group half of the members are primaries, the rest stand-ins,
+        and every fourth primary has assigned the vote. Each group also has the first
+        member of the next group as a stand-in, so users belong to several groups.
+        All members are registered users, and the unregistered email of the user
+        'invited' is a potential member of every group.
+    """
+
+    def __init__(self, groups, members):
+        self.groups_count = groups
+        self.members_count = members
+        self.config = testing.setUp()
+        self.config.include('arche.testing')
+        self.config.include('voteit.core.testing_helpers.register_catalog')
+        self.config.include('pyramid_chameleon')
+        self.config.include('voteit.vote_groups.models')
+        self.config.registry.registerAdapter(_FixedPresence, required=(IMeeting,), provided=IMeetingPresence)
+        self.db = DB(None)
+        self.connection = self.db.open()
+        root = bootstrap_and_fixture(self.config)
+        self.connection.root()['app_root'] = root
+        self.request = self.new_request(root)
+        self.config.begin(self.request)
+        from voteit.core.models.meeting import Meeting
+        root['m'] = self.meeting = Meeting()
+        self.request.meeting = self.meeting
+        self.populate()
+        transaction.commit()
+
+    def new_request(self, root, **kw):
+        request = testing.DummyRequest(**kw)
+        apply_request_extensions(request)
+        request.root = root
+        request.meeting = getattr(self, 'meeting', None)
+        request.is_moderator = True
+        return request
+
+    @property
+    def vote_groups(self):
+        return self.request.registry.getMultiAdapter((self.meeting, self.request), IVoteGroups)
+
+    def populate(self):
+        from arche.resources import User
+        from voteit.vote_groups.models import get_pending_emails
+        vote_groups = self.vote_groups
+        users = self.request.root['users']
+        pending = get_pending_emails(self.request.root, create=True)
+        vote_groups.settings = {
+            'assigned_voter_roles': {security.ROLE_VIEWER, security.ROLE_DISCUSS, security.ROLE_PROPOSE},
+            'inactive_voter_roles': {security.ROLE_VIEWER},
+        }
+        present = set()
+        names = ['g%s' % i for i in range(self.groups_count)]
+        for (i, name) in enumerate(names):
+            vote_groups.new(name)
+            group = vote_groups[name]
+            group.title = 'Group %s' % i
+            userids = ['%su%s' % (name, j) for j in range(self.members_count)]
+            for userid in userids:
+                users[userid] = User(email='%s@voteit.se' % userid, email_validated=True)
+            group.potential_members.add('invited@voteit.se')
+            pending.index_group(group)
+            primaries = userids[:(len(userids) + 1) // 2]
+            standins = userids[len(primaries):]
+            for userid in primaries:
+                group[userid] = ROLE_PRIMARY
+            for userid in standins:
+                group[userid] = ROLE_STANDIN
+            for (primary, standin) in zip(primaries[::4], standins):
+                vote_groups.assign_vote(primary, standin, group, event=False)
+            present.update(userids[::2])
+        for (name, next_name) in zip(names, names[1:]):
+            vote_groups[name]['%su0' % next_name] = ROLE_STANDIN
+        self.meeting._benchmark_present = present
+        # Added last, so the email isn't resolved while the groups are populated
+        users['invited'] = User(email='invited@voteit.se', email_validated=True)
+
+    def close(self):
+        transaction.abort()
+        self.connection.close()
+        self.db.close()
+        testing.tearDown()
+
+
+def _timed(func, repeat):
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+        # Don't let writes pile up between runs
+        transaction.abort()
+    timings.sort()
+    return {
+        'min': timings[0],
+        'median': timings[len(timings) // 2],
+        'mean': sum(timings) / len(timings),
+        'runs': repeat,
+    }
+
+
+def benchmark_cases(fixture):
+    """ Return list of (name, callable). Each callable covers one page worth of calls,
+        i.e. per-user methods are called once for every member.
+    """
+    from voteit.vote_groups.models import PresentWithVoteGroupsVoters
+    from voteit.vote_groups.models import apply_adjust_meeting_roles
+    meeting = fixture.meeting
+
+    def vg():
+        return fixture.vote_groups
+
+    def uncached_vg():
+        # Email lookups are memoized on the request
+        request = fixture.new_request(fixture.request.root)
+        return request.registry.getMultiAdapter((meeting, request), IVoteGroups)
+
+    def members():
+        return sorted(vg().get_members())
+
+    def per_member(method_name):
+        def _run():
+            vote_groups = vg()
+            method = getattr(vote_groups, method_name)
+            for userid in members():
+                method(userid)
+        return _run
+
+    def per_membership(method_name):
+        def _run():
+            vote_groups = vg()
+            method = getattr(vote_groups, method_name)
+            for group in vote_groups.values():
+                for userid in group.keys():
+                    method(userid, group)
+        return _run
+
+    def get_free_standins():
+        vote_groups = vg()
+        for group in vote_groups.values():
+            vote_groups.get_free_standins(group)
+
+    def can_set_role():
+        vote_groups = vg()
+        for group in vote_groups.values():
+            for userid in group.keys():
+                vote_groups.can_set_role(userid, ROLE_PRIMARY, group)
+
+    def new():
+        vg().new()
+
+    def email_validated():
+        vg().email_validated(fixture.request.root['users']['invited'])
+
+    def update_from_appstruct():
+        request = fixture.new_request(fixture.request.root)
+        group = vg().values()[0]
+        group.update_from_appstruct(group.appstruct(), request)
+
+    def copy_from_meeting():
+        from voteit.core.models.meeting import Meeting
+        fixture.request.root['m2'] = other = Meeting()
+        fixture.request.registry.getMultiAdapter((other, fixture.request), IVoteGroups).copy_from_meeting(meeting)
+
+    def assign_and_release():
+        vote_groups = vg()
+        for group in vote_groups.values():
+            free = sorted(vote_groups.get_free_standins(group))
+            primary = [x for x in group.primaries if x not in group.assignments][:1]
+            if free and primary:
+                vote_groups.assign_vote(primary[0], free[0], group)
+                vote_groups.release_substitute(free[0], group)
+
+    def set_role():
+        vote_groups = vg()
+        for group in vote_groups.values():
+            standins = [x for x in group.standins if group.get_primary_for(x) is None][:1]
+            for userid in standins:
+                if vote_groups.can_set_role(userid, ROLE_PRIMARY, group):
+                    vote_groups.set_role(userid, ROLE_PRIMARY, group)
+                    vote_groups.set_role(userid, ROLE_STANDIN, group)
+
+    def adjust_roles_all():
+        apply_adjust_meeting_roles(meeting, request=fixture.request)
+
+    def adjust_roles_group():
+        vote_groups = vg()
+        apply_adjust_meeting_roles(meeting, vote_groups.values()[0], request=fixture.request)
+
+    def present_voters():
+        PresentWithVoteGroupsVoters(meeting).get_voters(request=fixture.request)
+
+    def save_roles():
+        from voteit.vote_groups.views import VoteGroupsView
+        group = vg().values()[0]
+        post = dict((userid, role) for (userid, role) in group.items())
+        request = fixture.new_request(fixture.request.root, post=post, params={'vote_group': group.name})
+        VoteGroupsView(meeting, request).save_roles()
+
+    def render_page():
+        from voteit.vote_groups.views import VoteGroupsView
+        request = fixture.new_request(fixture.request.root)
+        view = VoteGroupsView(meeting, request)
+        response = view.delegations_view()
+        response['view'] = view
+        render('voteit.vote_groups:templates/meeting_vote_groups.pt', response, request=request)
+
+    def render_group_bodies():
+        from voteit.vote_groups.views import VoteGroupsView
+        for name in vg().keys():
+            request = fixture.new_request(fixture.request.root, params={'vote_group': name})
+            view = VoteGroupsView(meeting, request)
+            response = view.group_body()
+            response['view'] = view
+            render('voteit.vote_groups:templates/vote_group_body.pt', response, request=request)
+
+    return [
+        ('new', new),
+        ('get_standin_for', per_member('get_standin_for')),
+        ('get_primary_for', per_member('get_primary_for')),
+        ('get_voting_group_for', per_member('get_voting_group_for')),
+        ('vote_groups_for_user', per_member('vote_groups_for_user')),
+        ('sorted', lambda: vg().sorted()),
+        ('get_members', lambda: vg().get_members()),
+        ('userids_to_emails', lambda: list(uncached_vg().userids_to_emails(members()))),
+        ('get_emails', lambda: uncached_vg().get_emails()),
+        ('email_validated', email_validated),
+        ('update_from_appstruct', update_from_appstruct),
+        ('get_voters', lambda: vg().get_voters()),
+        ('get_primaries', lambda: vg().get_primaries()),
+        ('get_free_standins', get_free_standins),
+        ('copy_from_meeting', copy_from_meeting),
+        ('can_substitute', per_membership('can_substitute')),
+        ('can_assign', per_membership('can_assign')),
+        ('can_release', per_membership('can_release')),
+        ('get_assign_permission', per_membership('get_assign_permission')),
+        ('can_set_role', can_set_role),
+        ('assign_vote+release_substitute', assign_and_release),
+        ('set_role', set_role),
+        ('apply_adjust_meeting_roles', adjust_roles_all),
+        ('apply_adjust_meeting_roles_group', adjust_roles_group),
+        ('PresentWithVoteGroupsVoters.get_voters', present_voters),
+        ('save_roles', save_roles),
+        ('render_meeting_vote_groups', render_page),
+        ('render_vote_group_bodies', render_group_bodies),
+    ]
+
+
+def run_benchmarks(sizes, repeat=3, only=None, out=None):
+    # type: (list, int, set, file) -> dict
+    """ Run all benchmarks for each (groups, members) in sizes.
+        Failing cases are reported with their error instead of timings.
+    """
+    results = []
+    for (groups, members) in sizes:
+        fixture = BenchmarkFixture(groups, members)
+        try:
+            for (name, func) in benchmark_cases(fixture):
+                if only and name not in only:
+                    continue
+                entry = {'name': name, 'groups': groups, 'members': members}
+                try:
+                    entry.update(_timed(func, repeat))
+                except Exception as exc:
+                    transaction.abort()
+                    entry['error'] = '%s: %s' % (exc.__class__.__name__, exc)
+                results.append(entry)
+                if out is not None:
+                    print("%(name)s %(groups)sx%(members)s" % entry,
+                          entry.get('error', "%.4fs" % entry.get('median', 0)), file=out)
+        finally:
+            fixture.close()
+    return {
+        'meta': {
+            'created': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'git_revision': _git_revision(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def assignment_stress(threads=8, rounds=20, max_retries=10):
+    # type: (int, int, int) -> dict
+    """ Let each thread assign and release its own vote within the same group, committing
+        after every change, against a FileStorage in a temporary directory.
+        Changes fire AssignmentChanged like in production, so every commit also runs
+        the role adjustment that writes the meeting's local roles.
+        Conflicts are retried, and the number of conflicts and failed operations is reported.
+    """
+    import shutil
+    import tempfile
+    import threading
+    from ZODB.FileStorage import FileStorage
+    from ZODB.POSException import ConflictError
+    from voteit.core.models.meeting import Meeting
+    from voteit.vote_groups.models import VoteGroups
+
+    config = testing.setUp()
+    config.include('arche.testing')
+    config.include('voteit.vote_groups.models')
+    tmpdir = tempfile.mkdtemp()
+    db = DB(FileStorage('%s/Data.fs' % tmpdir))
+    stats = {'threads': threads, 'rounds': rounds, 'operations': 0, 'conflicts': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def _vote_groups(conn):
+        request = testing.DummyRequest()
+        # Worker threads don't have the registry pushed
+        request.registry = config.registry
+        request.is_moderator = True
+        return VoteGroups(conn.root()['m'], request)
+
+    def _worker(i):
+        # Each thread has its own default transaction manager, which the role adjustment hook uses
+        conn = db.open()
+        counts = {'operations': 0, 'conflicts': 0, 'failed': 0}
+        try:
+            for j in range(rounds * 2):
+                for attempt in range(max_retries):
+                    transaction.begin()
+                    try:
+                        vote_groups = _vote_groups(conn)
+                        group = vote_groups['g']
+                        if j % 2:
+                            vote_groups.release_substitute('p%s' % i, group)
+                        else:
+                            vote_groups.assign_vote('p%s' % i, 's%s' % i, group)
+                        transaction.commit()
+                        counts['operations'] += 1
+                        break
+                    except ConflictError:
+                        transaction.abort()
+                        counts['conflicts'] += 1
+                else:
+                    counts['failed'] += 1
+                    break
+        finally:
+            conn.close()
+            with lock:
+                for (k, v) in counts.items():
+                    stats[k] += v
+
+    try:
+        conn = db.open()
+        conn.root()['m'] = Meeting()
+        vote_groups = _vote_groups(conn)
+        vote_groups.settings = {
+            'assigned_voter_roles': {security.ROLE_VIEWER, security.ROLE_DISCUSS, security.ROLE_PROPOSE},
+            'inactive_voter_roles': {security.ROLE_VIEWER},
+        }
+        vote_groups.new('g')
+        for i in range(threads):
+            vote_groups['g']['p%s' % i] = ROLE_PRIMARY
+            vote_groups['g']['s%s' % i] = ROLE_STANDIN
+        transaction.commit()
+        conn.close()
+        workers = [threading.Thread(target=_worker, args=(i,)) for i in range(threads)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        stats['seconds'] = time.time() - start
+    finally:
+        db.close()
+        shutil.rmtree(tmpdir)
+        testing.tearDown()
+    attempts = stats['operations'] + stats['conflicts']
+    stats['conflict_rate'] = attempts and float(stats['conflicts']) / attempts or 0.0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark voteit.vote_groups")
+    parser.add_argument('--groups', type=_csv_ints, default=DEFAULT_GROUPS,
+                        help="Comma separated number of groups, default: %(default)s")
+    parser.add_argument('--members', type=_csv_ints, default=DEFAULT_MEMBERS,
+                        help="Comma separated members per group, default: %(default)s")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', action='append', help="Only run this benchmark, may be repeated")
+    parser.add_argument('--output', help="Write JSON here instead of stdout")
+    parser.add_argument('--stress', type=int, metavar='THREADS',
+                        help="Run the concurrent assignment stress test with this many threads instead")
+    args = parser.parse_args(argv)
+    if args.stress:
+        print(json.dumps(assignment_stress(threads=args.stress, rounds=args.repeat * 10), indent=2, sort_keys=True))
+        return
+    sizes = [(g, m) for g in args.groups for m in args.members]
+    data = run_benchmarks(sizes, repeat=args.repeat, only=args.only and set(args.only), out=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(data, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -2,7 +2,7 @@
 from arche.models.evolver import BaseEvolver
 
 
-VERSION = 1
+VERSION = 11
 
 
 class GroupsEvolver(BaseEvolver):
@@ -0,0 +1,8 @@
+from voteit.core.models.interfaces import IMeeting
+
+
+def evolve(root):
+    """ Set the flag that tells if a meeting has vote groups """
+    for meeting in root.values():
+        if IMeeting.providedBy(meeting) and len(getattr(meeting, '_vote_groups', ())):
+            meeting._vote_groups_active = True
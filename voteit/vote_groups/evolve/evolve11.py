@@ -0,0 +1,9 @@
+from voteit.core.models.interfaces import IMeeting
+from voteit.vote_groups.models import rebuild_index
+
+
+def evolve(root):
+    """ Rebuild the index to count members with the voter role instead of checked in members """
+    for meeting in root.values():
+        if IMeeting.providedBy(meeting) and hasattr(meeting, '_vote_groups_index'):
+            rebuild_index(meeting)
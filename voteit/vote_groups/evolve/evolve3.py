@@ -0,0 +1,9 @@
+from voteit.core.models.interfaces import IMeeting
+from voteit.vote_groups.models import rebuild_index
+
+
+def evolve(root):
+    """ Rebuild the vote groups index to include the set of current voters """
+    for meeting in root.values():
+        if IMeeting.providedBy(meeting) and hasattr(meeting, '_vote_groups'):
+            rebuild_index(meeting)
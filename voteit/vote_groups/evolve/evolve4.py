@@ -0,0 +1,22 @@
+from BTrees.OOBTree import OOTreeSet
+from voteit.core.models.interfaces import IMeeting
+from voteit.vote_groups.interfaces import IVoteGroup
+from voteit.vote_groups.interfaces import ROLE_PRIMARY
+from voteit.vote_groups.interfaces import ROLE_STANDIN
+
+
+def evolve(root):
+    """ Partition vote group members by role """
+    for meeting in root.values():
+        if not IMeeting.providedBy(meeting):
+            continue
+        for obj in getattr(meeting, '_vote_groups', {}).values():
+            if not IVoteGroup.providedBy(obj):
+                continue
+            obj._primaries = OOTreeSet()
+            obj._standins = OOTreeSet()
+            for (userid, role) in obj.data.items():
+                if role == ROLE_PRIMARY:
+                    obj._primaries.add(userid)
+                elif role == ROLE_STANDIN:
+                    obj._standins.add(userid)
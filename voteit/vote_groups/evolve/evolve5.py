@@ -0,0 +1,18 @@
+from voteit.core.models.interfaces import IMeeting
+from voteit.vote_groups.interfaces import IVoteGroup
+from voteit.vote_groups.models import Assignments
+
+
+def evolve(root):
+    """ Move vote group assignments to a container with a reverse lookup """
+    for meeting in root.values():
+        if not IMeeting.providedBy(meeting):
+            continue
+        for obj in getattr(meeting, '_vote_groups', {}).values():
+            if not IVoteGroup.providedBy(obj) or isinstance(obj.assignments, Assignments):
+                continue
+            assignments = Assignments()
+            for (primary, standin) in obj.assignments.items():
+                assignments.data[primary] = standin
+                assignments.substitutes[standin] = primary
+            obj.assignments = assignments
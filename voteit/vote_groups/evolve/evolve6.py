@@ -0,0 +1,14 @@
+from voteit.core.models.interfaces import IMeeting
+from voteit.vote_groups.interfaces import IVoteGroup
+from voteit.vote_groups.models import PendingEmails
+
+
+def evolve(root):
+    """ Build the site-wide index of potential members """
+    pending = root._vote_groups_pending_emails = PendingEmails()
+    for meeting in root.values():
+        if not IMeeting.providedBy(meeting):
+            continue
+        for obj in getattr(meeting, '_vote_groups', {}).values():
+            if IVoteGroup.providedBy(obj):
+                pending.index_group(obj)
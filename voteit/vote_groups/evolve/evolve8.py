@@ -0,0 +1,19 @@
+from voteit.core.models.interfaces import IMeeting
+from voteit.vote_groups.interfaces import IVoteGroup
+
+
+def evolve(root):
+    """ Store assignments as plain dicts within the assignments record, so concurrent
+        assignments can be merged on conflict.
+    """
+    for meeting in root.values():
+        if not IMeeting.providedBy(meeting):
+            continue
+        for obj in getattr(meeting, '_vote_groups', {}).values():
+            if not IVoteGroup.providedBy(obj):
+                continue
+            assignments = obj.assignments
+            if isinstance(assignments.data, dict):
+                continue
+            assignments.data = dict(assignments.data.items())
+            assignments.substitutes = dict(assignments.substitutes.items())
@@ -0,0 +1,18 @@
+from BTrees.Length import Length
+from voteit.core.models.interfaces import IMeeting
+from voteit.vote_groups.interfaces import IVoteGroup
+from voteit.vote_groups.models import rebuild_index
+
+
+def evolve(root):
+    """ Add member and role counters to vote groups, and rebuild the index with its counters """
+    for meeting in root.values():
+        if not IMeeting.providedBy(meeting) or not hasattr(meeting, '_vote_groups'):
+            continue
+        for obj in meeting._vote_groups.values():
+            if not IVoteGroup.providedBy(obj):
+                continue
+            obj._members_count = Length(len(obj.data))
+            obj._primaries_count = Length(len(obj._primaries))
+            obj._standins_count = Length(len(obj._standins))
+        rebuild_index(meeting)
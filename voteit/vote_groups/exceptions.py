@@ -4,3 +4,7 @@ from __future__ import unicode_literals
 
 class GroupPermissionsException(Exception):
     pass
+
+
+class ImportFileError(Exception):
+    pass
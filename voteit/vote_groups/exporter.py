@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+""" Export of groups, roles, assignments and current voters as CSV or JSON lines. """
+from __future__ import unicode_literals
+
+import csv
+import json
+from io import BytesIO
+
+from typing import Iterable
+
+from voteit.vote_groups.interfaces import IVoteGroups
+from voteit.vote_groups.interfaces import ROLE_PRIMARY
+from voteit.vote_groups.interfaces import ROLE_STANDIN
+from voteit.vote_groups.models import is_voting
+
+
+EXPORT_COLUMNS = (
+    'group',
+    'group_title',
+    'userid',
+    'role',
+    'assigned_to',
+    'substitute_for',
+    'votes_in_group',
+    'voter',
+)
+
+
+def export_rows(vote_groups):
+    # type: (IVoteGroups) -> Iterable[tuple]
+    """ Yield one tuple per membership, with values in the order of EXPORT_COLUMNS.
+        Roles, assignments and voter status are read from the meeting index,
+        so nothing is recomputed per row.
+    """
+    index = vote_groups.index
+    voters = index.voters
+    for group in vote_groups.sorted():
+        for userid in group.keys():
+            (role, assigned) = index.get(userid)[group.name]
+            yield (
+                group.name,
+                group.title,
+                userid,
+                role,
+                assigned if role == ROLE_PRIMARY else None,
+                assigned if role == ROLE_STANDIN else None,
+                is_voting(role, assigned),
+                userid in voters,
+            )
+
+
+def iter_export_rows(meeting, request):
+    # type: (IMeeting, IRequest) -> Iterable[tuple]
+    """ Like export_rows, but meant to be iterated after the view returned.
+        The request's database connection is closed by then, so the meeting is
+        loaded through a connection of its own, that's open while rows are read.
+        Meetings that aren't stored in a database are read directly.
+    """
+    jar = getattr(meeting, '_p_jar', None)
+    if jar is None or meeting._p_oid is None:
+        conn = None
+    else:
+        conn = jar.db().open()
+        meeting = conn.get(meeting._p_oid)
+    try:
+        vote_groups = request.registry.getMultiAdapter((meeting, request), IVoteGroups)
+        for row in export_rows(vote_groups):
+            yield row
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def _csv_value(value):
+    if value is None:
+        return b''
+    if isinstance(value, bool):
+        return value and b'1' or b'0'
+    return value.encode('utf-8')
+
+
+def iter_csv(rows):
+    # type: (Iterable[tuple]) -> Iterable[bytes]
+    """ Serialize one row at a time, starting with a header. """
+    buf = BytesIO()
+    writer = csv.writer(buf)
+    for row in _with_header(rows):
+        writer.writerow([_csv_value(x) for x in row])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def iter_jsonl(rows):
+    # type: (Iterable[tuple]) -> Iterable[bytes]
+    for row in rows:
+        yield (json.dumps(dict(zip(EXPORT_COLUMNS, row)), sort_keys=True) + '\n').encode('utf-8')
+
+
+def _with_header(rows):
+    yield EXPORT_COLUMNS
+    for row in rows:
+        yield row
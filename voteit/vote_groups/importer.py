@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+""" Bulk import of groups, members and roles from CSV or XLSX.
+
+Each row is: group, userid or email, role. Role may be left out, stand-in is the default.
+The group column matches an existing group by name or title, anything else creates
+a new group. A first row with 'role' in the third column is treated as a header.
+"""
+from __future__ import unicode_literals
+
+import csv
+from collections import OrderedDict
+
+from six import string_types
+from typing import Iterable
+from pyramid.traversal import find_root
+
+from voteit.vote_groups import _
+from voteit.vote_groups.exceptions import ImportFileError
+from voteit.vote_groups.interfaces import ROLE_PRIMARY
+from voteit.vote_groups.interfaces import ROLE_STANDIN
+from voteit.vote_groups.interfaces import VOTE_GROUP_ROLES
+from voteit.vote_groups.models import get_pending_emails
+from voteit.vote_groups.models import get_users_by_emails
+from voteit.vote_groups.models import normalize_email
+try:
+    import openpyxl
+except ImportError:  # pragma: no cover
+    openpyxl = None
+
+
+def _decode(value):
+    # type: (bytes) -> string_types
+    """ UTF-8, or cp1252 which Excel uses for CSV exports with Swedish settings. """
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value.decode('cp1252')
+
+
+def read_csv(fileobj):
+    # type: (file) -> Iterable[list]
+    """ Rows are read and decoded one at a time, only a bounded sample is read
+        up front to detect the delimiter.
+    """
+    sample = fileobj.read(4096)
+    fileobj.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=str(',;\t'))
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(fileobj, dialect)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error:
+            raise ImportFileError(_("Can't read row ${lineno} of the CSV file.",
+                                    mapping={'lineno': reader.line_num}))
+        try:
+            yield [_decode(x).lstrip('\ufeff').strip() for x in row]
+        except UnicodeDecodeError:
+            raise ImportFileError(_("Row ${lineno} contains characters that can't be read. "
+                                    "Save the file as CSV with UTF-8 encoding.",
+                                    mapping={'lineno': reader.line_num}))
+
+
+def read_xlsx(fileobj):
+    # type: (file) -> Iterable[list]
+    if openpyxl is None:  # pragma: no cover
+        raise ImportFileError(_("XLSX files require openpyxl to be installed."))
+    try:
+        workbook = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    except Exception:
+        raise ImportFileError(_("Not a valid XLSX file."))
+    for row in workbook.active.iter_rows(values_only=True):
+        yield ['' if x is None else unicode(x).strip() for x in row]
+
+
+def read_rows(fileobj, filename):
+    # type: (file, string_types) -> Iterable[tuple]
+    """ Yield (line number, group, user, role) for each row with content. """
+    if filename.lower().endswith('.xlsx'):
+        reader = read_xlsx(fileobj)
+    else:
+        reader = read_csv(fileobj)
+    for (lineno, row) in enumerate(reader, start=1):
+        row = (list(row) + ['', '', ''])[:3]
+        if not any(row):
+            continue
+        if lineno == 1 and row[2].lower() == 'role':
+            continue
+        yield (lineno, row[0], row[1], row[2].lower() or ROLE_STANDIN)
+
+
+class ImportPlan(object):
+    """ Validated result of reading an import file. Nothing is changed until apply is called. """
+
+    def __init__(self, vote_groups):
+        self.vote_groups = vote_groups
+        # Key is group name for existing groups, lowercased title for new ones
+        self.groups = OrderedDict()
+        self.errors = []
+
+    def add_error(self, lineno, msg):
+        self.errors.append((lineno, msg))
+
+    def get_group_entry(self, value):
+        # type: (string_types) -> dict
+        group = self.vote_groups.get(value)
+        if group is None:
+            lowered = value.lower()
+            for candidate in self.vote_groups.values():
+                if candidate.title.lower() == lowered:
+                    group = candidate
+                    break
+        key = group.name if group is not None else value.lower()
+        if key not in self.groups:
+            self.groups[key] = {
+                'group': group,
+                'title': group.title if group is not None else value,
+                'members': OrderedDict(),
+                'emails': set(),
+            }
+        return self.groups[key]
+
+    def changes(self, entry):
+        # type: (dict) -> tuple
+        """ Return (members, emails) of entry that would actually change the group,
+            i.e. new members or new roles, and emails that aren't potential members already.
+        """
+        group = entry['group']
+        if group is None:
+            return (dict(entry['members']), set(entry['emails']))
+        members = dict((userid, role) for (userid, role) in entry['members'].items()
+                       if group.get(userid) != role)
+        return (members, entry['emails'].difference(group.potential_members))
+
+    def summary(self):
+        # type: () -> dict
+        """ Counts of what apply would change. Rows that match the current state aren't counted. """
+        summary = {'new_groups': 0, 'existing_groups': 0, 'members': 0, 'potential_members': 0}
+        for entry in self.groups.values():
+            (members, emails) = self.changes(entry)
+            if entry['group'] is None:
+                summary['new_groups'] += 1
+            elif members or emails:
+                summary['existing_groups'] += 1
+            summary['members'] += len(members)
+            summary['potential_members'] += len(emails)
+        return summary
+
+    def apply(self):
+        # type: () -> dict
+        """ Write everything. Each changed group fires one AssignmentChanged event,
+            and role adjustments are coalesced to the end of the transaction.
+        """
+        vote_groups = self.vote_groups
+        request = vote_groups.request
+        summary = self.summary()
+        pending = get_pending_emails(request.root, create=True)
+        for entry in self.groups.values():
+            (members, new_emails) = self.changes(entry)
+            group = entry['group']
+            if group is None:
+                group = vote_groups[vote_groups.new()]
+                group.title = entry['title']
+            elif not members and not new_emails:
+                continue
+            for (userid, role) in members.items():
+                group[userid] = role
+            if new_emails:
+                group.potential_members.update(new_emails)
+                if pending is not None:
+                    for email in new_emails:
+                        pending.add(email, vote_groups.context.uid, group.name)
+            vote_groups.notify_changed(group)
+        vote_groups.invalidate_cache()
+        return summary
+
+
+def plan_import(vote_groups, rows):
+    # type: (IVoteGroups, Iterable[tuple]) -> ImportPlan
+    """ Read and validate all rows against the same rules as the forms:
+        existing users, valid roles, one primary per user across groups and
+        no role changes for users with assigned votes.
+    """
+    plan = ImportPlan(vote_groups)
+    request = vote_groups.request
+    users = find_root(vote_groups.context)['users']
+    roles = dict(VOTE_GROUP_ROLES)
+    email_rows = []
+    # userid -> (lineno, group entry) where this user is primary in the file
+    file_primaries = {}
+    for (lineno, group_value, user, role) in rows:
+        if not group_value:
+            plan.add_error(lineno, _("Group missing"))
+            continue
+        if not user:
+            plan.add_error(lineno, _("User or email missing"))
+            continue
+        if role not in roles:
+            plan.add_error(lineno, _("No such role: ${role}", mapping={'role': role}))
+            continue
+        entry = plan.get_group_entry(group_value)
+        if '@' in user:
+            email_rows.append((lineno, entry, user, role))
+            continue
+        if user not in users:
+            plan.add_error(lineno, _("No user with userid ${userid}", mapping={'userid': user}))
+            continue
+        _add_member(plan, lineno, entry, user, role, file_primaries)
+    if email_rows:
+        found = get_users_by_emails(request, [x[2] for x in email_rows], only_validated=True)
+        for (lineno, entry, email, role) in email_rows:
+            user = found.get(normalize_email(email))
+            if user is not None:
+                _add_member(plan, lineno, entry, user.userid, role, file_primaries)
+            elif role == ROLE_PRIMARY:
+                plan.add_error(lineno, _("${email} isn't a registered user and can only be added as stand-in",
+                                         mapping={'email': email}))
+            else:
+                entry['emails'].add(email)
+    _check_primaries(plan, file_primaries)
+    return plan
+
+
+def _add_member(plan, lineno, entry, userid, role, file_primaries):
+    current = entry['members'].get(userid)
+    if current is not None and current != role:
+        plan.add_error(lineno, _("${userid} has different roles in the same group",
+                                 mapping={'userid': userid}))
+        return
+    group = entry['group']
+    if group is not None and userid in group and group[userid] != role and \
+            (userid in group.assignments or group.get_primary_for(userid)):
+        plan.add_error(lineno, _("Can not change role for ${userid} with assigned voter rights.",
+                                 mapping={'userid': userid}))
+        return
+    entry['members'][userid] = role
+    if role == ROLE_PRIMARY:
+        if userid in file_primaries and file_primaries[userid][1] is not entry:
+            plan.add_error(lineno, _("${userid} is primary in more than one group",
+                                     mapping={'userid': userid}))
+            return
+        file_primaries[userid] = (lineno, entry)
+
+
+def _check_primaries(plan, file_primaries):
+    index = plan.vote_groups.index
+    for (userid, (lineno, entry)) in file_primaries.items():
+        own_name = entry['group'] is not None and entry['group'].name or None
+        for (name, (role, assigned)) in index.get(userid).items():
+            if role != ROLE_PRIMARY or name == own_name:
+                continue
+            # Allowed if the file turns the user into a stand-in in that group
+            if plan.groups.get(name, {}).get('members', {}).get(userid) == ROLE_STANDIN:
+                continue
+            plan.add_error(lineno, _("User(s) ${users} are already primary in another group.",
+                                     mapping={'users': userid}))
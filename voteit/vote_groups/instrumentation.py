@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+""" Optional timing of vote groups hot paths.
+
+Enable with the Pyramid setting::
+
+    vote_groups.instrumentation = true
+
+Each request then collects call counts and total time for the instrumented functions.
+A summary is logged when the request finishes, and the last summaries can be
+inspected by moderators through the view '_vote_groups_timings' on a meeting.
+Only requests within that meeting are listed.
+"""
+from __future__ import unicode_literals
+
+import logging
+import time
+from collections import deque
+from functools import wraps
+
+from pyramid.events import BeforeRender
+from pyramid.events import NewResponse
+from pyramid.settings import asbool
+from pyramid.threadlocal import get_current_request
+from voteit.core import security
+from voteit.core.models.interfaces import IMeeting
+
+
+SETTING = 'vote_groups.instrumentation'
+
+logger = logging.getLogger(__name__)
+
+# Summaries of the latest instrumented requests in this process
+recent_summaries = deque(maxlen=50)
+
+
+def is_enabled(request):
+    # type: (IRequest) -> bool
+    if request is None:
+        return False
+    try:
+        return request._vote_groups_instrumentation
+    except AttributeError:
+        settings = request.registry.settings or {}
+        enabled = asbool(settings.get(SETTING, False))
+        request._vote_groups_instrumentation = enabled
+        return enabled
+
+
+def get_stats(request):
+    # type: (IRequest) -> dict
+    """ Return name -> [calls, seconds] for this request. """
+    try:
+        return request._vote_groups_timings
+    except AttributeError:
+        stats = request._vote_groups_timings = {}
+        request.add_finished_callback(log_summary)
+        return stats
+
+
+def record(request, name, seconds):
+    stats = get_stats(request)
+    entry = stats.setdefault(name, [0, 0.0])
+    entry[0] += 1
+    entry[1] += seconds
+
+
+def summary(request):
+    # type: (IRequest) -> dict
+    stats = getattr(request, '_vote_groups_timings', {})
+    return {
+        'path': request.path,
+        'method': request.method,
+        'timings': dict((k, {'calls': v[0], 'seconds': round(v[1], 6)}) for (k, v) in stats.items()),
+    }
+
+
+def log_summary(request):
+    data = summary(request)
+    recent_summaries.append(data)
+    parts = ["%s=%sx/%.4fs" % (k, v['calls'], v['seconds']) for (k, v) in sorted(data['timings'].items())]
+    logger.info("vote_groups timings %s %s: %s", data['method'], data['path'], " ".join(parts))
+
+
+def timed(name):
+    """ Decorator that times the function if instrumentation is enabled.
+        Times are inclusive, so nested instrumented calls are counted in both.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kw):
+            request = get_current_request()
+            if not is_enabled(request):
+                return func(*args, **kw)
+            start = time.time()
+            try:
+                return func(*args, **kw)
+            finally:
+                record(request, name, time.time() - start)
+        return wrapper
+    return decorator
+
+
+def instrumented(cls):
+    """ Class decorator, times all public methods defined on the class. """
+    for (attr, value) in list(cls.__dict__.items()):
+        if attr.startswith('_') or not callable(value) or isinstance(value, type):
+            continue
+        setattr(cls, attr, timed('%s.%s' % (cls.__name__, attr))(value))
+    return cls
+
+
+def _is_own_renderer(event):
+    info = event.get('renderer_info')
+    package = getattr(info, 'package', None)
+    return getattr(package, '__name__', '').startswith('voteit.vote_groups')
+
+
+def render_started(event):
+    request = event.get('request')
+    if is_enabled(request) and _is_own_renderer(event):
+        request._vote_groups_render = (event['renderer_info'].name, time.time())
+
+
+def render_finished(event):
+    request = event.request
+    started = getattr(request, '_vote_groups_render', None)
+    if started is not None:
+        (name, start) = started
+        record(request, 'render:%s' % name, time.time() - start)
+        del request._vote_groups_render
+
+
+def timings_view(context, request):
+    """ Recent request summaries within this meeting, newest first.
+        The summaries are kept for the whole process, so requests for
+        other meetings must be filtered out.
+    """
+    meeting_path = request.resource_path(context)
+    return {
+        'enabled': is_enabled(request),
+        'requests': [x for x in reversed(recent_summaries)
+                     if _within(x['path'], meeting_path)],
+    }
+
+
+def _within(path, meeting_path):
+    # type: (string_types, string_types) -> bool
+    return path == meeting_path.rstrip('/') or path.startswith(meeting_path)
+
+
+def includeme(config):
+    config.add_subscriber(render_started, BeforeRender)
+    config.add_subscriber(render_finished, NewResponse)
+    config.add_view(timings_view,
+                    name='_vote_groups_timings',
+                    context=IMeeting,
+                    permission=security.MODERATE_MEETING,
+                    renderer='json')
@@ -22,6 +22,7 @@ class IVoteGroups(IDict):
         Implements a dict-like interface to handle VoteGroup objects.
     """
     settings = Attribute("Settings")
+    version = Attribute("Counter that changes whenever memberships, roles or assignments change.")
 
     def new(name=None):
         """ New meeting vote group. Returns id. """
@@ -41,15 +42,30 @@ class IVoteGroups(IDict):
     def get_voters():
         """ Return set of users with current vote rights according to groups """
 
+    def get_present_voters(present_userids):
+        """ Return set of current voters among present_userids. """
+
+    def get_email_info(userids):
+        """ Return dict userid -> (email, validated) for existing users. Memoized per request. """
+
     def get_primaries(exclude_group):
         """ Return set with all primary voters, excluding exclude_group if present """
 
     def get_free_standins(group):
         """ Return set with free stand-ins for vote group """
 
+    def invalidate_cache():
+        """ Drop derived sets cached on the current request. """
+
+    def email_validated(user, group_names=None):
+        """ Move user from potential members to stand-in, in all groups or only group_names. """
+
     def copy_from_meeting(meeting):
         """ Transfer all groups from another meeting, if they don't already exist. """
 
+    def copy_from_meetings(meetings, dry_run=False):
+        """ Transfer members and roles of groups from several meetings. Returns a summary. """
+
     def can_substitute(userid, group):
         """ Check if user is available as substitute in group """
 
@@ -80,8 +96,8 @@ class IVoteGroup(IDict):
     description = Attribute("Description")
     assignments = Attribute("Votes assigned from a primary voter to a standin.")
     potential_members = Attribute("Persistent set of email addresses.")
-    primaries = Attribute("Primary representatives")
-    standins = Attribute("Standins, iterator")
+    primaries = Attribute("Primary representatives, read-only set")
+    standins = Attribute("Standins, read-only set")
 
     def __init__(name, title="", description=""):
         """ Constructor, normally not passed any values within this app. """
@@ -5,9 +5,19 @@ from UserDict import IterableUserDict
 from persistent import Persistent
 from uuid import uuid4
 
+import transaction
+from BTrees.IIBTree import IITreeSet
+from BTrees.IIBTree import difference
+from BTrees.IIBTree import intersection
+from BTrees.IOBTree import IOBTree
+from BTrees.OIBTree import OIBTree
 from BTrees.OOBTree import OOBTree
+from BTrees.Length import Length
 from BTrees.OOBTree import OOSet
+from BTrees.OOBTree import OOTreeSet
 from arche.interfaces import IEmailValidatedEvent
+from arche.interfaces import IObjectUpdatedEvent
+from arche.interfaces import IRoot
 from arche.interfaces import IUser
 from pyramid.decorator import reify
 from pyramid.interfaces import IRequest
@@ -17,16 +27,19 @@ from pyramid.traversal import find_root
 from repoze.catalog.query import Any, Eq
 from six import string_types
 from typing import Iterable
+from voteit.core import security
 from voteit.core.models.interfaces import IMeeting
 from voteit.irl.models.elegible_voters_method import ElegibleVotersMethod
 from voteit.irl.models.interfaces import IMeetingPresence
+from ZODB.POSException import ConflictError
 from zope.component import adapter
-from zope.copy import copy
 from zope.interface import implementer
 
 from voteit.vote_groups import _
 from voteit.vote_groups.events import AssignmentChanged
 from voteit.vote_groups.exceptions import GroupPermissionsException
+from voteit.vote_groups.instrumentation import instrumented
+from voteit.vote_groups.instrumentation import timed
 from voteit.vote_groups.interfaces import IAssignmentChanged
 from voteit.vote_groups.interfaces import IVoteGroup
 from voteit.vote_groups.interfaces import IVoteGroups
@@ -35,6 +48,10 @@ from voteit.vote_groups.interfaces import ROLE_STANDIN
 from voteit.vote_groups.interfaces import VOTE_GROUP_ROLES
 
 
+_ACTIVE_MEETING_STATES = ('ongoing', 'upcoming')
+
+
+@instrumented
 @implementer(IVoteGroups)
 @adapter(IMeeting, IRequest)
 class VoteGroups(object, IterableUserDict):
@@ -44,13 +61,38 @@ class VoteGroups(object, IterableUserDict):
         self.context = context
         self.request = request
 
-    @reify
+    @property
     def data(self):
+        """ Groups storage. Meetings without groups get an empty mapping that isn't attached,
+            so reading never writes to the meeting. Storage is created by the first group added.
+        """
         try:
             return self.context._vote_groups
         except AttributeError:
+            return self._empty_data
+
+    @property
+    def index(self):
+        # type: () -> VoteGroupsIndex
+        try:
+            return self.context._vote_groups_index
+        except AttributeError:
+            return self._empty_index
+
+    @reify
+    def _empty_data(self):
+        return OOBTree()
+
+    @reify
+    def _empty_index(self):
+        return VoteGroupsIndex()
+
+    def _create_storage(self):
+        if not hasattr(self.context, '_vote_groups'):
             self.context._vote_groups = OOBTree()
-            return self.context._vote_groups
+        if not hasattr(self.context, '_vote_groups_index'):
+            index = self.context._vote_groups_index = VoteGroupsIndex()
+            index.sync_voter_roles(security.find_role_userids(self.context, security.ROLE_VOTER))
 
     @property
     def settings(self):
@@ -68,46 +110,63 @@ class VoteGroups(object, IterableUserDict):
         return name
 
     def get_standin_for(self, userid):
-        for group in self.values():
-            if userid in group.assignments:
-                return group.assignments[userid]
+        for (role, assigned) in self.index.get(userid).values():
+            if role == ROLE_PRIMARY and assigned:
+                return assigned
 
     def get_primary_for(self, userid):
         """ Get the userid and group for who 'userid' replaces. """
-        for group in self.values():
-            primary_for = group.get_primary_for(userid)
-            if primary_for:
-                return primary_for, group
+        for (name, (role, assigned)) in sorted(self.index.get(userid).items()):
+            if role == ROLE_STANDIN and assigned:
+                return assigned, self[name]
         return None, None
 
     def get_voting_group_for(self, userid):
-        for group in self.values():
-            if userid in group.get_voters():
-                return group
+        for (name, (role, assigned)) in sorted(self.index.get(userid).items()):
+            if is_voting(role, assigned):
+                return self[name]
 
     def get_members(self):
-        members = set()
-        for group in self.values():
-            members.update(group.keys())
-        return members
+        return self.index.get_userids(self.index.member_ids)
 
-    def userids_to_emails(self, userids, validated=True):
-        # type: (Iterable, bool) -> Iterable
-        root = find_root(self.context)
+    def get_email_info(self, userids):
+        # type: (Iterable) -> dict
+        """ Return userid -> (email, validated) for all existing users in userids.
+            Results are memoized on the request, and user objects that weren't loaded
+            already are turned back into ghosts so large lookups don't fill the ZODB cache.
+        """
+        userids = list(userids)
+        cache = getattr(self.request, '_vote_groups_email_info', None)
+        if cache is None:
+            cache = self.request._vote_groups_email_info = {}
+        users = None
         for userid in userids:
+            if userid in cache:
+                continue
+            if users is None:
+                users = find_root(self.context)['users']
             try:
-                user = root['users'][userid]
+                user = users[userid]
             except KeyError:
+                cache[userid] = None
                 continue
-            if user.email:
-                if validated and not user.email_validated:  # pragma: no cover
+            was_ghost = getattr(user, '_p_changed', False) is None
+            cache[userid] = (user.email, user.email_validated)
+            if was_ghost:
+                user._p_deactivate()
+        return dict((x, cache[x]) for x in userids if cache.get(x) is not None)
+
+    def userids_to_emails(self, userids, validated=True):
+        # type: (Iterable, bool) -> Iterable
+        for (email, email_validated) in self.get_email_info(userids).values():
+            if email:
+                if validated and not email_validated:  # pragma: no cover
                     continue
-                yield(user.email)
+                yield(email)
 
     def get_emails(self, group_names=None, potential=True, validated=True):
         if group_names is None:
             group_names = self.keys()
-        root = find_root(self.context)
         emails = set()
         userids = set()
         for group in self.values():
@@ -121,15 +180,22 @@ class VoteGroups(object, IterableUserDict):
         return emails
 
     def get_voters(self):
-        voter_rights = set()
-        for grp in self.values():
-            voter_rights.update(grp.get_voters())
-        return voter_rights
+        return set(self.index.voters)
+
+    def get_present_voters(self, present_userids):
+        # type: (Iterable) -> set
+        index = self.index
+        return index.get_userids(intersection(index.voter_ids, index.get_ids(present_userids)))
 
     @property
     def voters(self):
-        return self.get_voters()
-        # TODO Cache this, but drop on any changes, even in individual groups.
+        # type: () -> frozenset
+        return self._cached('voters', lambda: frozenset(self.index.voters))
+
+    @property
+    def version(self):
+        # type: () -> int
+        return self.index.version()
 
     def get_primaries(self, exclude_group=None):
         # type: (VoteGroup) -> set[string_types]
@@ -147,41 +213,125 @@ class VoteGroups(object, IterableUserDict):
         return filter(lambda g: userid in g, self.sorted())
 
     def get_free_standins(self, group):
-        # type: (VoteGroup) -> set[string_types]
-        return set(group.standins).difference(self.voters)
+        # type: (VoteGroup) -> frozenset[string_types]
+        return self._cached(('free_standins', group.name),
+                            lambda: frozenset(group.standins).difference(self.voters))
+
+    @property
+    def _request_cache(self):
+        # type: () -> dict
+        """ Derived sets are cached on the request, so all adapters for this meeting share them.
+            The cache is dropped by the mutation methods of this adapter, or if the index
+            version changed.
+        """
+        caches = getattr(self.request, '_vote_groups_cache', None)
+        if caches is None:
+            caches = self.request._vote_groups_cache = {}
+        cache = caches.setdefault(id(self.context), {})
+        version = self.version
+        if cache.get('version') != version:
+            cache.clear()
+            cache['version'] = version
+        return cache
+
+    def _cached(self, key, factory):
+        cache = self._request_cache
+        try:
+            return cache[key]
+        except KeyError:
+            value = cache[key] = factory()
+            return value
+
+    def invalidate_cache(self):
+        caches = getattr(self.request, '_vote_groups_cache', {})
+        caches.pop(id(self.context), None)
 
     def __setitem__(self, key, vg):
         assert IVoteGroup.providedBy(vg)
+        self._create_storage()
         # To make traversal work
         vg.__parent__ = self.context
+        if key in self.data:
+            self.index.unindex_group(self.data[key])
         self.data[key] = vg
+        if not is_active(self.context):
+            self.context._vote_groups_active = True
+            self.request.__dict__.pop('_vote_groups_active', None)
+        self.index.index_group(vg)
+        if vg.potential_members:
+            pending = get_pending_emails(find_root(self.context), create=True)
+            if pending is not None:
+                pending.index_group(vg)
+        self.invalidate_cache()
+
+    def __delitem__(self, key):
+        self.index.unindex_group(self.data[key])
+        pending = get_pending_emails(find_root(self.context))
+        if pending is not None:
+            pending.unindex_group(self.data[key])
+        del self.data[key]
+        if not self.data:
+            self.context._vote_groups_active = False
+            self.request.__dict__.pop('_vote_groups_active', None)
+        self.invalidate_cache()
 
     def __bool__(self):
         """ This object should be "true" even if it has no content. """
         return True
     __nonzero__ = __bool__
 
-    def email_validated(self, user):
+    def email_validated(self, user, group_names=None):
         assert IUser.providedBy(user)
-        if user.email:
-            for group in self.values():
-                if user.email in group.potential_members:
-                    group.potential_members.remove(user.email)
-                    group[user.userid] = ROLE_STANDIN
+        if not user.email:
+            return
+        if group_names is None:
+            groups = self.values()
+        else:
+            groups = [self[x] for x in group_names if x in self]
+        email = normalize_email(user.email)
+        pending = get_pending_emails(find_root(self.context))
+        for group in groups:
+            # Potential members are stored as typed, so match on the normalized address
+            # and remove whatever spelling was stored.
+            stored = [x for x in group.potential_members if normalize_email(x) == email]
+            if not stored:
+                continue
+            for spelling in stored:
+                group.potential_members.remove(spelling)
+            if pending is not None:
+                pending.remove(email, self.context.uid, group.name)
+            group[user.userid] = ROLE_STANDIN
+            self.invalidate_cache()
 
     def copy_from_meeting(self, meeting):
         # type: (IMeeting) -> int
         """ Transfer all groups from another meeting, if they don't already exist.
         """
-        new_vote_groups = self.request.registry.getMultiAdapter((meeting, self.request), IVoteGroups)
-        counter = 0
-        for (name, vote_group) in new_vote_groups.items():
-            if name not in self:
-                self[name] = copy(vote_group)
-                # Clear all assignments
-                self[name].assignments.clear()
-                counter += 1
-        return counter
+        return self.copy_from_meetings([meeting])['groups']
+
+    def copy_from_meetings(self, meetings, dry_run=False):
+        # type: (Iterable[IMeeting], bool) -> dict
+        """ Transfer groups from several meetings. On name collisions the first meeting wins,
+            and groups that already exist here are skipped.
+            Only membership, roles and potential members are copied. The source groups are
+            read directly, so assignments are never loaded and nothing is written to the source.
+            Returns a summary, and nothing is changed if dry_run is set.
+        """
+        summary = {'groups': 0, 'members': 0, 'potential_members': 0, 'skipped': []}
+        copied = set()
+        for meeting in meetings:
+            source = getattr(meeting, '_vote_groups', {})
+            for (name, vote_group) in source.items():
+                if name in self or name in copied:
+                    summary['skipped'].append(name)
+                    continue
+                copied.add(name)
+                summary['groups'] += 1
+                summary['members'] += len(vote_group)
+                summary['potential_members'] += len(vote_group.potential_members)
+                if not dry_run:
+                    self[name] = vote_group.copy_structure()
+        return summary
 
     def can_substitute(self, userid, group):
         # type: (string_types, VoteGroup) -> bool
@@ -189,9 +339,10 @@ class VoteGroups(object, IterableUserDict):
 
     def can_assign(self, userid, group):
         # type: (string_types, VoteGroup) -> bool
-        return bool(userid in group and userid in group.primaries and
-                    userid not in group.assignments and
-                    self.get_free_standins(group))
+        return self._cached(('can_assign', group.name, userid),
+                            lambda: bool(userid in group and userid in group.primaries and
+                                         userid not in group.assignments and
+                                         self.get_free_standins(group)))
 
     def can_release(self, userid, group):
         # type: (string_types, VoteGroup) -> bool
@@ -214,6 +365,8 @@ class VoteGroups(object, IterableUserDict):
         if not self.can_assign(from_userid, group) or not self.can_substitute(to_userid, group):
             raise GroupPermissionsException('Cannot assign vote')
         group.assignments[from_userid] = to_userid
+        self.index.index_users(group, (from_userid, to_userid))
+        self.invalidate_cache()
         if event:
             self.notify_changed(group)
 
@@ -230,7 +383,9 @@ class VoteGroups(object, IterableUserDict):
                 raise GroupPermissionsException('Cannot release vote')
         if not primary:
             raise GroupPermissionsException('No vote to release')
-        del group.assignments[primary]
+        standin = group.assignments.pop(primary)
+        self.index.index_users(group, (primary, standin))
+        self.invalidate_cache()
         if event:
             self.notify_changed(group)
 
@@ -239,12 +394,14 @@ class VoteGroups(object, IterableUserDict):
         if not self.can_set_role(userid, role, group):
             raise GroupPermissionsException('Cannot set role')
         group[userid] = role
+        self.invalidate_cache()
         if event:
             self.notify_changed(group)
 
     def update_from_appstruct(self, appstruct, group):
         # type: (dict, VoteGroup) -> None
         group.update_from_appstruct(appstruct, self.request)
+        self.invalidate_cache()
         self.notify_changed(group)
 
     def notify_changed(self, group):
@@ -269,39 +426,121 @@ class VoteGroup(Persistent, IterableUserDict):
         self.description = description
         # Use userid as key and role as value, or none
         self.data = OOBTree()
+        # Userids partitioned by role, kept in sync with data
+        self._primaries = OOTreeSet()
+        self._standins = OOTreeSet()
+        # Counters for data and the role sets, so sizes don't require loading them
+        self._members_count = Length()
+        self._primaries_count = Length()
+        self._standins_count = Length()
         # Assigned
-        self.assignments = OOBTree()
+        self.assignments = Assignments()
         # Potential members - simply list emails
         self.potential_members = OOSet()
 
+    def __setitem__(self, key, role):
+        previous = self.data.get(key)
+        if self.data.insert(key, role):
+            self._members_count.change(1)
+        else:
+            self.data[key] = role
+        if previous != role:
+            self._remove_from_role_set(key, previous)
+            role_set = self._role_set(role)
+            if role_set is not None and role_set.add(key):
+                self._role_counter(role).change(1)
+        self._reindex(key)
+
+    def __delitem__(self, key):
+        role = self.data.pop(key)
+        self._members_count.change(-1)
+        self._remove_from_role_set(key, role)
+        # Assignments can't outlive a membership, the other part gets the vote back
+        other = self.assignments.pop(key, None)
+        if other is None:
+            other = self.assignments.get_primary_for(key)
+            if other is not None:
+                del self.assignments[other]
+        self._reindex(key)
+        if other is not None:
+            self._reindex(other)
+
+    def __len__(self):
+        return self._members_count()
+
+    def _role_set(self, role):
+        if role == ROLE_PRIMARY:
+            return self._primaries
+        if role == ROLE_STANDIN:
+            return self._standins
+
+    def _role_counter(self, role):
+        if role == ROLE_PRIMARY:
+            return self._primaries_count
+        if role == ROLE_STANDIN:
+            return self._standins_count
+
+    def _remove_from_role_set(self, userid, role):
+        role_set = self._role_set(role)
+        if role_set is not None and userid in role_set:
+            role_set.remove(userid)
+            self._role_counter(role).change(-1)
+
+    def count(self, role):
+        # type: (string_types) -> int
+        """ Number of members with role, without loading the role set. """
+        counter = self._role_counter(role)
+        return counter is not None and counter() or 0
+
+    def _reindex(self, userid):
+        """ Update the meeting-wide index, if this group is attached to a meeting. """
+        index = getattr(self.__parent__, '_vote_groups_index', None)
+        if index is not None and self.__parent__._vote_groups.get(self.name) is self:
+            index.index_users(self, (userid,))
+
+    def copy_structure(self):
+        # type: () -> VoteGroup
+        """ Return a new detached group with the same members, roles and potential members.
+            Assignments aren't copied.
+        """
+        vg = VoteGroup(self.name, title=self.title, description=self.description)
+        vg.data.update(self.data)
+        vg._primaries.update(self._primaries)
+        vg._standins.update(self._standins)
+        vg._members_count.set(len(self))
+        vg._primaries_count.set(self.count(ROLE_PRIMARY))
+        vg._standins_count.set(self.count(ROLE_STANDIN))
+        vg.potential_members.update(self.potential_members)
+        return vg
+
     def get_roles(self, role):
-        for (k, v) in self.items():
-            if v == role:
-                yield k
+        role_set = self._role_set(role)
+        if role_set is None:
+            return (k for (k, v) in self.items() if v == role)
+        return iter(role_set)
 
     @property
     def primaries(self):
-        return self.get_roles(ROLE_PRIMARY)
+        """ Read-only set of primaries. """
+        return self._primaries
 
     @property
     def standins(self):
-        return self.get_roles(ROLE_STANDIN)
+        """ Read-only set of stand-ins. """
+        return self._standins
 
     def get_voters(self):
         """
         :return: Set of userids who are potential voters for this group.
         """
-        return set(
-            list(self.assignments.values()) +
-            filter(lambda userid: userid not in self.assignments, self.primaries)
-        )
+        voters = set(self.assignments.values())
+        voters.update(x for x in self._primaries if x not in self.assignments)
+        return voters
 
     def get_primary_for(self, userid):
         # type: (string_types) -> string_types
         assert isinstance(userid, string_types)
-        for k, v in self.assignments.items():
-            if v == userid:
-                return k
+        return self.assignments.get_primary_for(userid)
 
     def get_substitute_for(self, userid):
         # type: (string_types) -> string_types
@@ -324,8 +563,10 @@ class VoteGroup(Persistent, IterableUserDict):
         # Find all potential members already registered
         potential_members = set()
         found = 0
-        for email in appstruct['potential_members'].splitlines():
-            user = request.root['users'].get_user_by_email(email, only_validated=True)
+        emails = appstruct['potential_members'].splitlines()
+        users = get_users_by_emails(request, emails, only_validated=True)
+        for email in emails:
+            user = users.get(normalize_email(email))
             if user:
                 incoming.add(user.userid)
                 found += 1
@@ -335,9 +576,423 @@ class VoteGroup(Persistent, IterableUserDict):
             del self[userid]
         for userid in incoming.difference(previous):
             self[userid] = ROLE_STANDIN
-        if set(self.potential_members) != potential_members:
+        current_potential = set(self.potential_members)
+        if current_potential != potential_members:
             self.potential_members.clear()
             self.potential_members.update(potential_members)
+            pending = None
+            if self.__parent__ is not None:
+                pending = get_pending_emails(request.root, create=True)
+            if pending is not None:
+                meeting_uid = self.__parent__.uid
+                for email in current_potential.difference(potential_members):
+                    pending.remove(email, meeting_uid, self.name)
+                for email in potential_members.difference(current_potential):
+                    pending.add(email, meeting_uid, self.name)
+
+
+def is_voting(role, assigned):
+    # type: (string_types, string_types) -> bool
+    """ Decide voter status from an index entry. Primaries vote unless they've assigned
+        their vote, stand-ins vote when they substitute for someone.
+    """
+    if role == ROLE_PRIMARY:
+        return not assigned
+    if role == ROLE_STANDIN:
+        return bool(assigned)
+    return False
+
+
+class VoteGroupsIndex(Persistent):
+    """ Meeting-wide reverse index for vote groups.
+
+        Stored as userid -> {group name: (role, assigned)} where assigned is the stand-in
+        a primary has handed the vote to, or the primary a stand-in substitutes for.
+        The values are plain dicts that are always replaced, never mutated in place.
+
+        The set of current voters is kept as its own persistent object, so its ZODB serial
+        tells other processes if their copy is stale. version is bumped on every change.
+
+        Members and voters are also kept as integer sets, using the interning table in userids,
+        so set operations between them run as merges of sorted integers.
+
+        counters holds Length objects for the numbers shown in summaries, for the whole meeting
+        and per group, see count. voter_role_ids are the users with the voter role in the
+        meeting, kept up to date by update_local_roles and voter_roles_changed, so members
+        with the voter role can be counted too.
+    """
+
+    def __init__(self):
+        self.users = OOBTree()
+        self.voters = OOTreeSet()
+        self.version = Length()
+        self.userids = UserIds()
+        self.member_ids = IITreeSet()
+        self.voter_ids = IITreeSet()
+        self.counters = OOBTree()
+        self.voter_role_ids = IITreeSet()
+
+    def get(self, userid):
+        # type: (string_types) -> dict
+        return self.users.get(userid, {})
+
+    def index_group(self, group):
+        # type: (VoteGroup) -> None
+        """ Only reads the raw group structures, so evolve steps can use this too. """
+        substitute_for = dict((v, k) for (k, v) in group.assignments.items())
+        for (userid, role) in group.data.items():
+            if role == ROLE_PRIMARY:
+                assigned = group.assignments.get(userid)
+            else:
+                assigned = substitute_for.get(userid)
+            self._set(userid, group.name, (role, assigned))
+
+    def unindex_group(self, group):
+        # type: (VoteGroup) -> None
+        userids = set(group.data.keys())
+        userids.update(group.assignments.values())
+        for userid in userids:
+            self._set(userid, group.name, None)
+        for key in ('voters', 'voter_role'):
+            self.counters.pop(_counter_key(key, group.name), None)
+
+    def index_users(self, group, userids):
+        # type: (VoteGroup, Iterable) -> None
+        for userid in userids:
+            if userid not in group.data:
+                self._set(userid, group.name, None)
+                continue
+            role = group.data[userid]
+            if role == ROLE_PRIMARY:
+                assigned = group.assignments.get(userid)
+            else:
+                assigned = group.get_primary_for(userid)
+            self._set(userid, group.name, (role, assigned))
+
+    def _set(self, userid, name, entry):
+        current = self.users.get(userid, {})
+        previous = current.get(name)
+        if previous == entry:
+            return
+        entries = dict(current)
+        if entry is None:
+            del entries[name]
+        else:
+            entries[name] = entry
+        intid = self.userids.intern(userid)
+        has_voter_role = intid in self.voter_role_ids
+        if entries:
+            self.users[userid] = entries
+            if self.member_ids.insert(intid):
+                self._change('members', 1)
+                if has_voter_role:
+                    self._change('voter_role', 1)
+        else:
+            del self.users[userid]
+            self.member_ids.remove(intid)
+            self._change('members', -1)
+            if has_voter_role:
+                self._change('voter_role', -1)
+        for (role, entry_delta) in ((previous and previous[0], -1), (entry and entry[0], 1)):
+            if role in (ROLE_PRIMARY, ROLE_STANDIN):
+                self._change(role, entry_delta)
+        was_voting = previous is not None and is_voting(*previous)
+        now_voting = entry is not None and is_voting(*entry)
+        if was_voting != now_voting:
+            self._change('voters', now_voting and 1 or -1, name)
+        if has_voter_role and (previous is None) != (entry is None):
+            self._change('voter_role', entry is None and -1 or 1, name)
+        voting = any(is_voting(*x) for x in entries.values())
+        if voting and userid not in self.voters:
+            self.voters.add(userid)
+            self.voter_ids.insert(intid)
+            self._change('voters', 1)
+        elif not voting and userid in self.voters:
+            self.voters.remove(userid)
+            self.voter_ids.remove(intid)
+            self._change('voters', -1)
+        self.version.change(1)
+
+    def _change(self, key, delta, name=None):
+        key = _counter_key(key, name)
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters[key] = Length()
+        counter.change(delta)
+
+    def count(self, key, name=None):
+        # type: (string_types, string_types) -> int
+        """ Read a counter. key is 'members', 'primary', 'standin', 'voters' or 'voter_role'
+            for the whole meeting, or 'voters' and 'voter_role' for the group called name.
+            'voters' are members that vote according to the groups, 'voter_role' members
+            that currently have the voter role in the meeting.
+            Role counts are memberships, so a user in two groups is counted twice.
+        """
+        counter = self.counters.get(_counter_key(key, name))
+        return counter is not None and counter() or 0
+
+    def sync_voter_roles(self, userids):
+        # type: (Iterable) -> None
+        """ Make userids the users with the voter role. Only users that differ are updated. """
+        current = self.get_userids(self.voter_role_ids)
+        userids = set(userids)
+        for userid in current.difference(userids):
+            self.set_voter_role(userid, False)
+        for userid in userids.difference(current):
+            self.set_voter_role(userid, True)
+
+    def set_voter_role(self, userid, has_role):
+        # type: (string_types, bool) -> None
+        """ Update the voter role counters when a single user gets or loses the voter role. """
+        intid = self.userids.intern(userid)
+        if has_role == (intid in self.voter_role_ids):
+            return
+        if has_role:
+            self.voter_role_ids.insert(intid)
+        else:
+            self.voter_role_ids.remove(intid)
+        delta = has_role and 1 or -1
+        entries = self.users.get(userid, {})
+        if entries:
+            self._change('voter_role', delta)
+        for name in entries:
+            self._change('voter_role', delta, name)
+
+    def get_ids(self, userids):
+        # type: (Iterable) -> IITreeSet
+        return self.userids.get_ids(userids)
+
+    def get_userids(self, ids):
+        # type: (Iterable[int]) -> set
+        return self.userids.get_userids(ids)
+
+
+class UserIds(Persistent):
+    """ Interning table between userids and integers. Ids are never reused within a meeting. """
+
+    def __init__(self):
+        self.ids = OIBTree()
+        self.userids = IOBTree()
+
+    def intern(self, userid):
+        # type: (string_types) -> int
+        try:
+            return self.ids[userid]
+        except KeyError:
+            intid = self.userids and self.userids.maxKey() + 1 or 1
+            self.ids[userid] = intid
+            self.userids[intid] = userid
+            return intid
+
+    def get_ids(self, userids):
+        # type: (Iterable) -> IITreeSet
+        """ Integer set for userids, unknown userids are left out. """
+        ids = self.ids
+        return IITreeSet([ids[x] for x in userids if x in ids])
+
+    def get_userids(self, ids):
+        # type: (Iterable[int]) -> set
+        userids = self.userids
+        return set(userids[x] for x in ids)
+
+
+def is_active(meeting):
+    # type: (IMeeting) -> bool
+    """ True if meeting has vote groups. A single attribute read that never loads the groups. """
+    return getattr(meeting, '_vote_groups_active', False)
+
+
+def _counter_key(key, name=None):
+    if name is None:
+        return key
+    return '%s:%s' % (key, name)
+
+
+def rebuild_index(meeting):
+    # type: (IMeeting) -> VoteGroupsIndex
+    """ Create a new index for all vote groups within meeting. Used by evolve steps. """
+    index = meeting._vote_groups_index = VoteGroupsIndex()
+    index.sync_voter_roles(security.find_role_userids(meeting, security.ROLE_VOTER))
+    for group in getattr(meeting, '_vote_groups', {}).values():
+        if IVoteGroup.providedBy(group):
+            index.index_group(group)
+    return index
+
+
+class Assignments(Persistent, IterableUserDict):
+    """ Votes assigned from a primary (key) to a stand-in (value).
+        Keeps a reverse mapping so the primary a stand-in substitutes for is a single lookup.
+        A stand-in can only hold one assignment at a time.
+
+        Both mappings are plain dicts stored in this record, so concurrent changes
+        can be merged by _p_resolveConflict.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.substitutes = {}
+
+    def __setitem__(self, primary, standin):
+        current = self.substitutes.get(standin)
+        if current is not None and current != primary:
+            raise GroupPermissionsException('Stand-in already assigned')
+        if primary in self.data:
+            del self.substitutes[self.data[primary]]
+        self.data[primary] = standin
+        self.substitutes[standin] = primary
+        self._p_changed = True
+
+    def __delitem__(self, primary):
+        standin = self.data.pop(primary)
+        del self.substitutes[standin]
+        self._p_changed = True
+
+    def pop(self, primary, *default):
+        if primary not in self.data and default:
+            return default[0]
+        standin = self.data[primary]
+        del self[primary]
+        return standin
+
+    def clear(self):
+        self.data.clear()
+        self.substitutes.clear()
+        self._p_changed = True
+
+    def get_primary_for(self, standin):
+        # type: (string_types) -> string_types
+        return self.substitutes.get(standin)
+
+    def _p_resolveConflict(self, old_state, committed_state, new_state):
+        """ Merge concurrent changes for different primaries. Changing the same primary
+            differently, or assigning the same stand-in twice, is still a conflict.
+        """
+        old = old_state.get('data', {})
+        committed = committed_state.get('data', {})
+        new = new_state.get('data', {})
+        merged = dict(committed)
+        for primary in set(old).union(new):
+            if old.get(primary) == new.get(primary):
+                continue
+            if committed.get(primary) not in (old.get(primary), new.get(primary)):
+                raise ConflictError("Both transactions changed the assignment of %r" % primary)
+            if primary in new:
+                merged[primary] = new[primary]
+            else:
+                merged.pop(primary, None)
+        substitutes = dict((v, k) for (k, v) in merged.items())
+        if len(substitutes) != len(merged):
+            raise ConflictError("Stand-in assigned by more than one primary")
+        state = dict(committed_state)
+        state['data'] = merged
+        state['substitutes'] = substitutes
+        return state
+
+
+def normalize_email(email):
+    # type: (string_types) -> string_types
+    return email.strip().lower()
+
+
+def get_users_by_emails(request, emails, only_validated=False):
+    # type: (IRequest, Iterable, bool) -> dict
+    """ Resolve many emails with a single catalog query.
+
+    :return: dict with normalized email as key and user as value.
+    """
+    emails = set(x.strip() for x in emails if x.strip())
+    if not emails:
+        return {}
+    emails.update(normalize_email(x) for x in list(emails))
+    query = Eq('type_name', 'User') & Any('email', list(emails))
+    docids = request.root.catalog.query(query)[1]
+    found = {}
+    for user in request.resolve_docids(docids, perm=None):
+        if not user.email or (only_validated and not user.email_validated):
+            continue
+        found[normalize_email(user.email)] = user
+    return found
+
+
+class PendingEmails(Persistent):
+    """ Site-wide index of potential members, stored on the root.
+        Normalized email -> tuple of (meeting uid, group name).
+    """
+
+    def __init__(self):
+        self.emails = OOBTree()
+
+    def get(self, email):
+        # type: (string_types) -> tuple
+        return self.emails.get(normalize_email(email), ())
+
+    def add(self, email, meeting_uid, name):
+        key = normalize_email(email)
+        entry = (meeting_uid, name)
+        current = self.emails.get(key, ())
+        if entry not in current:
+            self.emails[key] = current + (entry,)
+
+    def remove(self, email, meeting_uid, name):
+        key = normalize_email(email)
+        entry = (meeting_uid, name)
+        current = self.emails.get(key, ())
+        if entry not in current:
+            return
+        remaining = tuple(x for x in current if x != entry)
+        if remaining:
+            self.emails[key] = remaining
+        else:
+            del self.emails[key]
+
+    def index_group(self, group):
+        # type: (VoteGroup) -> None
+        for email in group.potential_members:
+            self.add(email, group.__parent__.uid, group.name)
+
+    def unindex_group(self, group):
+        # type: (VoteGroup) -> None
+        for email in group.potential_members:
+            self.remove(email, group.__parent__.uid, group.name)
+
+
+def get_pending_emails(root, create=False):
+    # type: (IRoot, bool) -> PendingEmails
+    """ Return the site-wide pending emails index or None if it doesn't exist.
+        It's only created on a site root.
+    """
+    pending = getattr(root, '_vote_groups_pending_emails', None)
+    if pending is None and create and IRoot.providedBy(root):
+        pending = root._vote_groups_pending_emails = PendingEmails()
+    return pending
+
+
+# Meeting oid -> (state key, frozenset of present voters). Only holds results computed from
+# committed state, so it's shared between requests and threads in this process.
+_present_voters_cache = {}
+
+
+def _state_token(obj):
+    """ Return (oid, serial) for an unmodified persistent object, or None if the object
+        isn't stored or has uncommitted changes.
+    """
+    if getattr(obj, '_p_oid', None) is None:
+        return None
+    obj._p_activate()
+    if obj._p_changed:
+        return None
+    return (obj._p_oid, obj._p_serial)
+
+
+def _present_voters_key(meeting, present_userids):
+    index = getattr(meeting, '_vote_groups_index', None)
+    if index is None or getattr(meeting, '_p_oid', None) is None:
+        return None
+    groups_token = _state_token(index.version)
+    presence_token = _state_token(present_userids)
+    if groups_token is None or presence_token is None:
+        return None
+    return (groups_token, presence_token)
 
 
 class PresentWithVoteGroupsVoters(ElegibleVotersMethod):
@@ -346,22 +1001,37 @@ class PresentWithVoteGroupsVoters(ElegibleVotersMethod):
     description = _("present_with_vote_groups_description",
                     default="Will set voter rights for present user according to vote groups settings.")
 
+    @timed('PresentWithVoteGroupsVoters.get_voters')
     def get_voters(self, request=None, **kw):
+        """ The result is cached per meeting as long as neither the vote groups index
+            nor the presence set have changed since they were committed.
+        """
         if request is None:
             request = get_current_request()
         meeting_presence = request.registry.getAdapter(self.context, IMeetingPresence)
+        present_userids = meeting_presence.present_userids
+        key = _present_voters_key(self.context, present_userids)
+        if key is not None:
+            cached = _present_voters_cache.get(self.context._p_oid)
+            if cached is not None and cached[0] == key:
+                return cached[1]
         groups = request.registry.getMultiAdapter((self.context, request), IVoteGroups)
-        return frozenset(groups.get_voters().intersection(meeting_presence.present_userids))
+        voters = frozenset(groups.get_present_voters(present_userids))
+        if key is not None:
+            _present_voters_cache[self.context._p_oid] = (key, voters)
+        return voters
 
 
-def apply_adjust_meeting_roles(meeting, group=None, request=None):
-    # type: (IMeeting, IVoteGroup, IRequest) -> None
+@timed('apply_adjust_meeting_roles')
+def apply_adjust_meeting_roles(meeting, group=None, request=None, groups=()):
+    # type: (IMeeting, IVoteGroup, IRequest, Iterable[IVoteGroup]) -> None
     """
     Adjust meeting roles according to settings, if there are any settings for this meeting.
 
     :param meeting: Meeting object
     :param group: Only check members of this group
     :param request: Current request
+    :param groups: Only check members of these groups
     """
     assert IMeeting.providedBy(meeting)
     if request is None:
@@ -375,45 +1045,141 @@ def apply_adjust_meeting_roles(meeting, group=None, request=None):
         return
     inactive_voter_roles = vote_groups.settings.get('inactive_voter_roles', set())
     remove_on_inactive = assigned_voter_roles.difference(inactive_voter_roles)
+    groups = list(groups)
     if group:
-        # Only for a specific group
-        assigned_voter_members = group.get_voters()
-        members = set(group.keys())
+        groups.append(group)
+    if groups:
+        # Only for specific groups
+        assigned_voter_members = set()
+        members = set()
+        for grp in groups:
+            assigned_voter_members.update(grp.get_voters())
+            members.update(grp.keys())
+        # Users may vote through another group
+        inactive_voters_members = members.difference(vote_groups.voters).difference(assigned_voter_members)
     else:  # pragma: no cover
         # Check all
+        index = vote_groups.index
         assigned_voter_members = vote_groups.get_voters()
-        members = vote_groups.get_members()
-    inactive_voters_members = members.difference(assigned_voter_members)
+        inactive_voters_members = index.get_userids(difference(index.member_ids, index.voter_ids))
     roles = meeting.local_roles
+    add = {}
+    remove = {}
+    # Only write for users where something actually differs
     for userid in assigned_voter_members:
-        roles.add(userid, assigned_voter_roles, event=False)
+        to_add = set(assigned_voter_roles).difference(roles.get(userid, ()))
+        if to_add:
+            add[userid] = to_add
     for userid in inactive_voters_members:
-        roles.remove(userid, remove_on_inactive, event=False)
-        roles.add(userid, inactive_voter_roles, event=False)
-    roles.send_event()
+        current = set(roles.get(userid, ()))
+        to_remove = current.intersection(remove_on_inactive)
+        to_add = set(inactive_voter_roles).difference(current)
+        if to_remove:
+            remove[userid] = to_remove
+        if to_add:
+            add[userid] = to_add
+    update_local_roles(meeting, add=add, remove=remove)
+
+
+@timed('update_local_roles')
+def update_local_roles(context, add=None, remove=None):
+    # type: (IMeeting, dict, dict) -> int
+    """ Apply local role changes as one change set.
+        add and remove are dicts of userid -> roles. Removals are applied first.
+        Users that already have the roles, or lack the ones to remove, aren't touched,
+        and a single event is sent if anything changed.
+        Returns the number of users whose roles changed.
+    """
+    roles = context.local_roles
+    changed = set()
+    for (userid, to_remove) in (remove or {}).items():
+        to_remove = set(to_remove).intersection(roles.get(userid, ()))
+        if to_remove:
+            roles.remove(userid, to_remove, event=False)
+            changed.add(userid)
+    for (userid, to_add) in (add or {}).items():
+        to_add = set(to_add).difference(roles.get(userid, ()))
+        if to_add:
+            roles.add(userid, to_add, event=False)
+            changed.add(userid)
+    if changed:
+        index = getattr(context, '_vote_groups_index', None)
+        if index is not None:
+            for userid in changed:
+                index.set_voter_role(userid, security.ROLE_VOTER in roles.get(userid, ()))
+        roles.send_event()
+    return len(changed)
 
 
+@timed('voter_roles_changed')
+def voter_roles_changed(meeting, event):
+    """ Local roles may be changed without update_local_roles, for instance from the
+        permissions view in voteit.core. Keep the voter role counters in sync.
+    """
+    if 'local_roles' not in (getattr(event, 'changed', None) or ()):
+        return
+    index = getattr(meeting, '_vote_groups_index', None)
+    if index is not None:
+        index.sync_voter_roles(security.find_role_userids(meeting, security.ROLE_VOTER))
+
+
+@timed('user_validated_email_subscriber')
 def user_validated_email_subscriber(event):
     """ Check for potential memberships.
-        This may be slow with a lot of ongoing meetings at the same time.
+        Uses the pending emails index to only touch groups that list the email.
+        Without the index, all ongoing and upcoming meetings are checked, which may be slow.
     """
     request = get_current_request()
     user = event.user
-    query = Eq('type_name', 'Meeting') & Any('workflow_state', ['ongoing', 'upcoming'])
-    docids = request.root.catalog.query(query)[1]
-    for meeting in request.resolve_docids(docids, perm=None):
+    if not user.email:
+        return
+    pending = get_pending_emails(request.root)
+    if pending is None:
+        query = Eq('type_name', 'Meeting') & Any('workflow_state', list(_ACTIVE_MEETING_STATES))
+        docids = request.root.catalog.query(query)[1]
+        targets = [(meeting, None) for meeting in request.resolve_docids(docids, perm=None)]
+    else:
+        group_names = {}
+        for (meeting_uid, name) in pending.get(user.email):
+            group_names.setdefault(meeting_uid, set()).add(name)
+        targets = []
+        for (meeting_uid, names) in group_names.items():
+            meeting = request.resolve_uid(meeting_uid, perm=None)
+            if meeting is not None and meeting.get_workflow_state() in _ACTIVE_MEETING_STATES:
+                targets.append((meeting, names))
+    for (meeting, names) in targets:
         vote_groups = request.registry.queryMultiAdapter((meeting, request), IVoteGroups)
         if vote_groups is not None:
-            vote_groups.email_validated(user)
+            vote_groups.email_validated(user, names)
 
 
+@timed('adjust_roles_after_assignment')
 def adjust_roles_after_assignment(event):
+    """ Collect changed groups and adjust roles once for all of them, just before
+        the transaction commits.
+    """
     meeting = find_interface(event.group, IMeeting)
-    apply_adjust_meeting_roles(meeting, event.group)
+    request = event.request
+    txn = transaction.get()
+    pending = getattr(request, '_vote_groups_pending_adjust', None)
+    if pending is None or getattr(request, '_vote_groups_adjust_txn', None) is not txn:
+        pending = request._vote_groups_pending_adjust = {}
+        request._vote_groups_adjust_txn = txn
+        txn.addBeforeCommitHook(apply_pending_adjustments, args=(request,))
+    pending.setdefault(id(meeting), (meeting, {}))[1][event.group.name] = event.group
+
+
+def apply_pending_adjustments(request):
+    """ Before commit hook, run one merged role adjustment per changed meeting. """
+    pending = getattr(request, '_vote_groups_pending_adjust', {})
+    request._vote_groups_pending_adjust = None
+    for (meeting, groups) in pending.values():
+        apply_adjust_meeting_roles(meeting, request=request, groups=groups.values())
 
 
 def includeme(config):
     config.registry.registerAdapter(VoteGroups, provided=IVoteGroups)
     config.add_subscriber(user_validated_email_subscriber, IEmailValidatedEvent)
+    config.add_subscriber(voter_roles_changed, [IMeeting, IObjectUpdatedEvent])
     config.add_subscriber(adjust_roles_after_assignment, IAssignmentChanged)
     config.registry.registerAdapter(PresentWithVoteGroupsVoters, name=PresentWithVoteGroupsVoters.name)
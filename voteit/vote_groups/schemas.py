@@ -116,14 +116,31 @@ class ApplyQRPresentVotersSchema(colander.Schema):
     )
 
 
+@colander.deferred
+def deferred_copy_from_meetings_widget(node, kw):
+    """ Same meetings as the copy widget in voteit.core, but several can be selected. """
+    widget = deferred_copy_from_meeting_widget(node, kw)
+    widget.values = [x for x in widget.values if x[0]]
+    widget.multiple = True
+    return widget
+
+
 class CopyFromOtherMeetingSchema(colander.Schema):
-    meeting_name = colander.SchemaNode(
-        colander.String(),
+    meeting_names = colander.SchemaNode(
+        colander.List(),
         title=_("Copy groups from another meeting"),
         description=_("copy_groups_description",
                       default="You can only pick meeting where you've been a moderator. "
                               "If a group exist here already it will be skipped"),
-        widget=deferred_copy_from_meeting_widget,
+        widget=deferred_copy_from_meetings_widget,
+        validator=colander.Length(min=1),
+    )
+    dry_run = colander.SchemaNode(
+        colander.Bool(),
+        title=_("Dry run"),
+        description=_("Only show what would be copied."),
+        default=False,
+        missing=False,
     )
 
 
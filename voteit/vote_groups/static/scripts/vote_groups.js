@@ -7,6 +7,7 @@ Roles.getForm = function(event) {
 Roles.start = function(event) {
     event.preventDefault();
     $form = Roles.getForm(event);
+    GroupBody.show($form);
     $form.addClass('editing');
 }
 
@@ -28,7 +29,57 @@ Roles.save = function(event) {
     })
 }
 
+var GroupBody = GroupBody || {};
+
+GroupBody.load = function($body) {
+    // Returns a promise, resolved when the member table is in place
+    if (!$body.data('request')) {
+        var request = $.get($body.data('group-body'))
+        .done(function(html) {
+            $body.html(html);
+        })
+        .fail(function(response) {
+            $body.removeData('request');
+            arche.flash_error(response);
+        });
+        $body.data('request', request);
+    }
+    return $body.data('request');
+}
+
+GroupBody.show = function($form) {
+    var $body = $form.find('[data-group-body]');
+    $body.removeClass('hidden');
+    return GroupBody.load($body);
+}
+
+GroupBody.toggle = function(event) {
+    event.preventDefault();
+    $form = Roles.getForm(event);
+    var $body = $form.find('[data-group-body]');
+    if ($body.data('request') && !$body.hasClass('hidden')) {
+        $body.addClass('hidden');
+    } else {
+        GroupBody.show($form);
+    }
+}
+
+GroupBody.printAll = function(event) {
+    event.preventDefault();
+    var requests = $('[data-roles-container]').map(function() {
+        return GroupBody.show($(this));
+    }).get();
+    $.when.apply($, requests).always(function() {
+        window.print();
+    });
+}
+
 $(function() {
     $('[data-edit-roles]').click(Roles.start);
     $('[data-save-roles]').click(Roles.save);
+    $('[data-expand-group]').click(GroupBody.toggle);
+    $('[data-print-all]').click(GroupBody.printAll);
+    $('[data-group-body][data-autoload]').each(function() {
+        GroupBody.load($(this));
+    });
 })
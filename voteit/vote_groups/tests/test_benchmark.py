@@ -0,0 +1,16 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+
+
+class BenchmarkTests(TestCase):
+
+    def test_run_small(self):
+        from voteit.vote_groups.benchmark import run_benchmarks
+        only = {'get_voters', 'get_voting_group_for', 'apply_adjust_meeting_roles', 'get_emails', 'email_validated'}
+        data = run_benchmarks([(3, 4)], repeat=1, only=only)
+        self.assertEqual({x['name'] for x in data['results']}, only)
+        for entry in data['results']:
+            self.assertNotIn('error', entry)
+            self.assertEqual(entry['groups'], 3)
+            self.assertEqual(entry['members'], 4)
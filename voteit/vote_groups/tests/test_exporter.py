@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+from unittest import TestCase
+
+from pyramid import testing
+from pyramid.request import apply_request_extensions
+from voteit.core.testing_helpers import bootstrap_and_fixture
+
+from voteit.vote_groups.interfaces import IVoteGroups
+from voteit.vote_groups.interfaces import ROLE_PRIMARY
+from voteit.vote_groups.interfaces import ROLE_STANDIN
+
+
+class ExporterTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _cut(self):
+        from voteit.vote_groups.models import VoteGroups
+        return VoteGroups
+
+    def _fixture(self):
+        from voteit.core.models.meeting import Meeting
+        from voteit.vote_groups.models import VoteGroups
+        self.config.include('arche.testing')
+        root = bootstrap_and_fixture(self.config)
+        request = testing.DummyRequest()
+        apply_request_extensions(request)
+        self.config.begin(request)
+        root['m'] = m = Meeting()
+        groups = VoteGroups(m, request)
+        groups.new('g1')
+        groups['g1'].title = 'Göteborg'
+        groups['g1']['one'] = ROLE_PRIMARY
+        groups['g1']['two'] = ROLE_STANDIN
+        groups['g1']['three'] = ROLE_PRIMARY
+        groups.assign_vote('one', 'two', groups['g1'], event=False)
+        return groups
+
+    def test_export_rows(self):
+        from voteit.vote_groups.exporter import export_rows
+        rows = sorted(export_rows(self._fixture()))
+        self.assertEqual(rows, [
+            ('g1', 'Göteborg', 'one', ROLE_PRIMARY, 'two', None, False, False),
+            ('g1', 'Göteborg', 'three', ROLE_PRIMARY, None, None, True, True),
+            ('g1', 'Göteborg', 'two', ROLE_STANDIN, None, 'one', True, True),
+        ])
+
+    def test_iter_csv(self):
+        from voteit.vote_groups.exporter import export_rows
+        from voteit.vote_groups.exporter import iter_csv
+        chunks = list(iter_csv(export_rows(self._fixture())))
+        self.assertEqual(len(chunks), 4)
+        self.assertTrue(chunks[0].startswith(b'group,group_title,userid'))
+        self.assertIn('g1,Göteborg,two,standin,,one,1,1\r\n'.encode('utf-8'), chunks)
+
+    def test_iter_jsonl(self):
+        from voteit.vote_groups.exporter import export_rows
+        from voteit.vote_groups.exporter import iter_jsonl
+        lines = [json.loads(x.decode('utf-8')) for x in iter_jsonl(export_rows(self._fixture()))]
+        self.assertEqual(len(lines), 3)
+        two = [x for x in lines if x['userid'] == 'two'][0]
+        self.assertEqual(two['substitute_for'], 'one')
+        self.assertTrue(two['voter'])
+
+    def test_iter_export_rows_own_connection(self):
+        import transaction
+        from ZODB import DB
+        from voteit.vote_groups.exporter import export_rows
+        from voteit.vote_groups.exporter import iter_export_rows
+        self.config.registry.registerAdapter(self._cut, provided=IVoteGroups)
+        groups = self._fixture()
+        db = DB(None)
+        conn = db.open()
+        try:
+            conn.root()['app_root'] = groups.context.__parent__
+            transaction.commit()
+            expected = sorted(export_rows(groups))
+            rows = iter_export_rows(groups.context, groups.request)
+            # Rows are read after the request's connection is closed
+            conn.close()
+            self.assertEqual(sorted(rows), expected)
+        finally:
+            transaction.abort()
+            db.close()
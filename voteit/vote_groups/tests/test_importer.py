@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from io import BytesIO
+from unittest import TestCase
+
+from pyramid import testing
+from pyramid.request import apply_request_extensions
+from voteit.core.testing_helpers import bootstrap_and_fixture
+
+from voteit.vote_groups.interfaces import ROLE_PRIMARY
+from voteit.vote_groups.interfaces import ROLE_STANDIN
+
+
+class ImporterTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _fixture(self):
+        from arche.resources import User
+        from voteit.core.models.meeting import Meeting
+        from voteit.vote_groups.models import VoteGroups
+        self.config.include('arche.testing')
+        self.config.include('voteit.core.testing_helpers.register_catalog')
+        root = bootstrap_and_fixture(self.config)
+        request = testing.DummyRequest()
+        apply_request_extensions(request)
+        request.root = root
+        self.config.begin(request)
+        root['m'] = m = Meeting()
+        root['users']['one'] = User(email='one@voteit.se', email_validated=True)
+        root['users']['two'] = User(email='two@voteit.se', email_validated=True)
+        groups = VoteGroups(m, request)
+        groups.new('g1')
+        groups['g1'].title = 'Existing'
+        groups['g1']['two'] = ROLE_PRIMARY
+        return groups
+
+    def _plan(self, groups, text):
+        from voteit.vote_groups.importer import plan_import
+        from voteit.vote_groups.importer import read_rows
+        return plan_import(groups, read_rows(BytesIO(text.encode('utf-8')), 'import.csv'))
+
+    def test_import(self):
+        groups = self._fixture()
+        plan = self._plan(groups, "group,user,role\n"
+                                  "existing,one,standin\n"
+                                  "New group,ONE@voteit.se,primary\n"
+                                  "New group,someone@voteit.se,\n")
+        self.assertEqual(plan.errors, [])
+        self.assertEqual(plan.summary(), {'new_groups': 1, 'existing_groups': 1,
+                                          'members': 2, 'potential_members': 1})
+        plan.apply()
+        self.assertEqual(groups['g1']['one'], ROLE_STANDIN)
+        new_group = [x for x in groups.values() if x.title == 'New group'][0]
+        self.assertEqual(new_group['one'], ROLE_PRIMARY)
+        self.assertEqual(set(new_group.potential_members), {'someone@voteit.se'})
+
+    def test_summary_only_counts_changes(self):
+        groups = self._fixture()
+        plan = self._plan(groups, "group,user,role\n"
+                                  "g1,two,primary\n"
+                                  "Existing,three@voteit.se,standin\n")
+        self.assertEqual(plan.summary(), {'new_groups': 0, 'existing_groups': 1,
+                                          'members': 0, 'potential_members': 1})
+        plan.apply()
+        plan = self._plan(groups, "g1,two,primary\n"
+                                  "g1,three@voteit.se,standin\n")
+        self.assertEqual(plan.summary(), {'new_groups': 0, 'existing_groups': 0,
+                                          'members': 0, 'potential_members': 0})
+
+    def test_validation(self):
+        groups = self._fixture()
+        plan = self._plan(groups, "Other;two;primary\n"
+                                  "Other;nobody;standin\n"
+                                  "Other;one;boss\n")
+        self.assertEqual([x[0] for x in plan.errors], [2, 3, 1])
+        self.assertEqual(len(groups), 1)
+
+    def test_read_csv_cp1252(self):
+        from voteit.vote_groups.importer import read_csv
+        rows = list(read_csv(BytesIO('Göteborg,one,standin\n'.encode('cp1252'))))
+        self.assertEqual(rows, [['Göteborg', 'one', 'standin']])
+
+    def test_read_csv_broken_row(self):
+        from voteit.vote_groups.exceptions import ImportFileError
+        from voteit.vote_groups.importer import read_csv
+        with self.assertRaises(ImportFileError):
+            list(read_csv(BytesIO(b'g1,one,standin\ng1,t\x00wo,standin\n')))
+
+    def test_read_csv_mixed_encodings(self):
+        from voteit.vote_groups.importer import read_csv
+        data = 'Göteborg,one,standin\n'.encode('utf-8') + 'Malmö,two,standin\n'.encode('cp1252')
+        self.assertEqual(list(read_csv(BytesIO(data))),
+                         [['Göteborg', 'one', 'standin'], ['Malmö', 'two', 'standin']])
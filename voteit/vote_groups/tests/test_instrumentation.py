@@ -0,0 +1,64 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+
+from pyramid import testing
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp(settings={'vote_groups.instrumentation': 'true'})
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def test_timed(self):
+        from voteit.vote_groups.instrumentation import timed
+        from voteit.vote_groups.instrumentation import summary
+
+        @timed('hello')
+        def hello():
+            return 'world'
+
+        request = testing.DummyRequest()
+        self.config.begin(request)
+        self.assertEqual(hello(), 'world')
+        hello()
+        self.assertEqual(summary(request)['timings']['hello']['calls'], 2)
+
+    def test_disabled(self):
+        from voteit.vote_groups.instrumentation import timed
+        self.config.registry.settings['vote_groups.instrumentation'] = 'false'
+
+        @timed('hello')
+        def hello():
+            return 'world'
+
+        request = testing.DummyRequest()
+        self.config.begin(request)
+        hello()
+        self.assertFalse(hasattr(request, '_vote_groups_timings'))
+
+    def test_log_summary(self):
+        from voteit.vote_groups.instrumentation import record
+        from voteit.vote_groups.instrumentation import log_summary
+        from voteit.vote_groups.instrumentation import recent_summaries
+        request = testing.DummyRequest()
+        record(request, 'VoteGroups.get_voters', 0.5)
+        log_summary(request)
+        self.assertEqual(recent_summaries[-1]['timings'], {'VoteGroups.get_voters': {'calls': 1, 'seconds': 0.5}})
+
+    def test_timings_view_only_lists_own_meeting(self):
+        from voteit.core.models.meeting import Meeting
+        from voteit.vote_groups.instrumentation import recent_summaries
+        from voteit.vote_groups.instrumentation import timings_view
+        root = testing.DummyResource()
+        root['m'] = m = Meeting()
+        root['m2'] = Meeting()
+        recent_summaries.clear()
+        for path in ('/m', '/m/vote_groups', '/m2/vote_groups', '/'):
+            recent_summaries.append({'path': path, 'method': 'GET', 'timings': {}})
+        request = testing.DummyRequest()
+        response = timings_view(m, request)
+        self.assertEqual([x['path'] for x in response['requests']], ['/m/vote_groups', '/m'])
@@ -64,6 +64,59 @@ class VoteGroupsTests(TestCase):
         new_groups.copy_from_meeting(old_groups.context)
         self.assertEqual(len(new_groups), 2)
 
+    def test_copy_from_meeting_structure(self):
+        from voteit.core.models.meeting import Meeting
+        old_groups = self._mk_one()
+        new_groups = self._cut(Meeting(), testing.DummyRequest())
+        new_groups.copy_from_meeting(old_groups.context)
+        group = new_groups['g1']
+        self.assertIsNot(group, old_groups['g1'])
+        self.assertEqual(dict(group.items()), dict(old_groups['g1'].items()))
+        self.assertEqual(set(group.primaries), {'two'})
+        self.assertEqual(set(group.standins), {'one', 'three'})
+        self.assertEqual(len(group.assignments), 0)
+        self.assertEqual(new_groups.get_voters(), {'two', 'three'})
+
+    def test_copy_from_meetings(self):
+        from voteit.core.models.meeting import Meeting
+        first = self._mk_one()
+        second = self._cut(Meeting(), testing.DummyRequest())
+        second.new('g2')
+        second.new('g3')
+        second['g3']['four'] = ROLE_PRIMARY
+        new_groups = self._cut(Meeting(), testing.DummyRequest())
+        summary = new_groups.copy_from_meetings([first.context, second.context], dry_run=True)
+        self.assertEqual(summary, {'groups': 3, 'members': 5, 'potential_members': 0, 'skipped': ['g2']})
+        self.assertEqual(len(new_groups), 0)
+        new_groups.copy_from_meetings([first.context, second.context])
+        self.assertEqual(set(new_groups.keys()), {'g1', 'g2', 'g3'})
+        self.assertEqual(dict(new_groups['g2'].items()), {'three': ROLE_PRIMARY})
+
+    def test_read_only_until_mutation(self):
+        from voteit.core.models.meeting import Meeting
+        meeting = Meeting()
+        groups = self._cut(meeting, testing.DummyRequest())
+        self.assertEqual(len(groups), 0)
+        self.assertEqual(list(groups.vote_groups_for_user('one')), [])
+        self.assertEqual(groups.get_voters(), set())
+        self.assertEqual(groups.get_present_voters(['one']), set())
+        self.assertFalse(hasattr(meeting, '_vote_groups'))
+        self.assertFalse(hasattr(meeting, '_vote_groups_index'))
+        groups.new('g1')
+        groups['g1']['one'] = ROLE_PRIMARY
+        self.assertIn('g1', meeting._vote_groups)
+        self.assertEqual(groups.get_voters(), {'one'})
+
+    def test_is_active(self):
+        from voteit.core.models.meeting import Meeting
+        from voteit.vote_groups.models import is_active
+        groups = self._cut(Meeting(), testing.DummyRequest())
+        self.assertFalse(is_active(groups.context))
+        groups.new('g1')
+        self.assertTrue(is_active(groups.context))
+        del groups['g1']
+        self.assertFalse(is_active(groups.context))
+
     def test_standins(self):
         groups = self._mk_one()
         self.assertEqual(groups.get_standin_for('two'), 'one')
@@ -76,6 +129,33 @@ class VoteGroupsTests(TestCase):
         groups = self._mk_one()
         self.assertEqual(groups.get_voters(), {'one', 'three'})
 
+    def test_voters_version(self):
+        groups = self._mk_one()
+        version = groups.version
+        groups['g2']['four'] = ROLE_PRIMARY
+        self.assertIn('four', groups.index.voters)
+        self.assertGreater(groups.version, version)
+        del groups['g2']
+        self.assertEqual(groups.get_voters(), {'one'})
+
+    def test_remove_assigned_standin(self):
+        groups = self._mk_one()
+        group = groups['g1']
+        del group['one']
+        self.assertEqual(len(group.assignments), 0)
+        self.assertEqual(group.get_voters(), {'two'})
+        self.assertEqual(groups.get_voters(), {'two', 'three'})
+        self.assertEqual(groups.index.get('two'), {'g1': (ROLE_PRIMARY, None)})
+
+    def test_remove_assigning_primary(self):
+        groups = self._mk_one()
+        group = groups['g1']
+        del group['two']
+        self.assertEqual(len(group.assignments), 0)
+        self.assertEqual(group.get_voters(), set())
+        self.assertEqual(groups.get_voters(), {'three'})
+        self.assertEqual(groups.index.get('one'), {'g1': (ROLE_STANDIN, None)})
+
     def test_primaries(self):
         groups = self._mk_one()
         self.assertEqual(groups.get_primaries(), {'two', 'three'})
@@ -101,6 +181,16 @@ class VoteGroupsTests(TestCase):
         self.assertEqual(groups.voters, {'one', 'three', 'four'})
         self.assertEqual(groups.get_free_standins(group), {'five'})
 
+    def test_free_standins_cache(self):
+        groups = self._mk_one()
+        group = groups['g1']
+        self.assertEqual(groups.get_free_standins(group), set())
+        self.assertFalse(groups.can_assign('two', group))
+        groups.request.is_moderator = True
+        groups.release_substitute('one', group)
+        self.assertEqual(groups.get_free_standins(group), {'one'})
+        self.assertTrue(groups.can_assign('two', group))
+
     def test_get_primary_for(self):
         groups = self._mk_one()
         primary, group = groups.get_primary_for('one')
@@ -114,6 +204,82 @@ class VoteGroupsTests(TestCase):
         self.assertEqual(len(group1), 3)
         self.assertEqual(len(group3), 1)
 
+    def test_index(self):
+        groups = self._mk_one()
+        self.assertEqual(groups.index.get('one'), {'g1': (ROLE_STANDIN, 'two')})
+        self.assertEqual(groups.index.get('three'), {'g1': (ROLE_STANDIN, None), 'g2': (ROLE_PRIMARY, None)})
+        groups.request.is_moderator = True
+        groups.release_substitute('one', groups['g1'])
+        self.assertEqual(groups.index.get('one'), {'g1': (ROLE_STANDIN, None)})
+        self.assertEqual(groups.get_voting_group_for('two'), groups['g1'])
+        self.assertIs(groups.get_standin_for('two'), None)
+
+    def test_index_delete_group(self):
+        groups = self._mk_one()
+        del groups['g1']
+        self.assertEqual(groups.index.get('one'), {})
+        self.assertEqual(groups.index.get('three'), {'g2': (ROLE_PRIMARY, None)})
+        self.assertEqual(groups.get_voting_group_for('three'), groups['g2'])
+
+    def test_index_integer_sets(self):
+        groups = self._mk_one()
+        index = groups.index
+        self.assertEqual(index.get_userids(index.member_ids), {'one', 'two', 'three'})
+        self.assertEqual(index.get_userids(index.voter_ids), {'one', 'three'})
+        del groups['g1']
+        self.assertEqual(index.get_userids(index.member_ids), {'three'})
+        self.assertEqual(set(index.get_ids(['one', 'two', 'nobody'])),
+                         {index.userids.intern('one'), index.userids.intern('two')})
+
+    def test_index_counters(self):
+        groups = self._mk_one()
+        index = groups.index
+        self.assertEqual(index.count('members'), 3)
+        self.assertEqual(index.count(ROLE_PRIMARY), 2)
+        self.assertEqual(index.count(ROLE_STANDIN), 2)
+        self.assertEqual(index.count('voters'), 2)
+        self.assertEqual(index.count('voters', 'g1'), 1)
+        self.assertEqual(index.count('voters', 'g2'), 1)
+        groups.request.is_moderator = True
+        groups.release_substitute('one', groups['g1'])
+        self.assertEqual(index.count('voters', 'g1'), 1)
+        self.assertEqual(index.count('voters'), 2)
+        del groups['g2']
+        self.assertEqual(index.count('members'), 3)
+        self.assertEqual(index.count('voters'), 1)
+        self.assertEqual(index.count('voters', 'g2'), 0)
+
+    def test_index_voter_role_counters(self):
+        from voteit.core import security
+        from voteit.vote_groups.models import update_local_roles
+        groups = self._mk_one()
+        index = groups.index
+        self.assertEqual(index.count('voter_role'), 0)
+        update_local_roles(groups.context, add={
+            'one': (security.ROLE_VOTER,),
+            'three': (security.ROLE_VOTER,),
+            'nobody': (security.ROLE_VOTER,),
+        })
+        self.assertEqual(index.count('voter_role'), 2)
+        self.assertEqual(index.count('voter_role', 'g1'), 2)
+        self.assertEqual(index.count('voter_role', 'g2'), 1)
+        update_local_roles(groups.context, remove={'one': (security.ROLE_VOTER,)})
+        self.assertEqual(index.count('voter_role', 'g1'), 1)
+        groups['g2']['nobody'] = ROLE_STANDIN
+        self.assertEqual(index.count('voter_role', 'g2'), 2)
+        self.assertEqual(index.count('voter_role'), 2)
+        # Roles changed elsewhere are picked up from the update event
+        from arche.events import ObjectUpdatedEvent
+        from voteit.vote_groups.models import voter_roles_changed
+        groups.context.local_roles.add('two', (security.ROLE_VOTER,), event=False)
+        voter_roles_changed(groups.context, ObjectUpdatedEvent(groups.context, changed=['local_roles']))
+        self.assertEqual(index.count('voter_role', 'g1'), 2)
+        self.assertEqual(index.count('voter_role'), 3)
+
+    def test_get_present_voters(self):
+        groups = self._mk_one()
+        self.assertEqual(groups.get_present_voters(['one', 'two', 'nobody']), {'one'})
+
     def test_assign_vote(self):
         groups = self._mk_one()
         group = groups.values()[0]
@@ -217,6 +383,8 @@ class VoteGroupsTests(TestCase):
         group.potential_members.add('support@voteit.se')
 
         self.assertEqual(groups.get_emails(), {'support@voteit.se', 'hello@world.org'})
+        self.assertEqual(groups.get_email_info(['one', 'nobody']), {'one': ('hello@world.org', True)})
+        self.assertIn('one', request._vote_groups_email_info)
 
     def test_traversal(self):
         groups = self._mk_one()
@@ -273,6 +441,114 @@ class VoteGroupsTests(TestCase):
         self.assertEqual(set(group.keys()), {'zero', 'one', 'two'})
         self.assertEqual(set(group.potential_members), {'support@voteit.se'})
 
+    def test_adjust_roles_coalesced(self):
+        import transaction
+        from voteit.core.models.meeting import Meeting
+        from voteit.core import security
+        from voteit.vote_groups.models import adjust_roles_after_assignment
+        transaction.begin()
+        self.config.add_subscriber(adjust_roles_after_assignment, IAssignmentChanged)
+        self.config.registry.registerAdapter(self._cut, provided=IVoteGroups)
+        request = testing.DummyRequest()
+        groups = self._cut(Meeting(), request)
+        groups.settings = {
+            'assigned_voter_roles': {security.ROLE_VIEWER, security.ROLE_DISCUSS},
+            'inactive_voter_roles': {security.ROLE_VIEWER},
+        }
+        self._initial_groups(groups)
+        group = groups['g1']
+        groups.set_role('one', ROLE_STANDIN, group)
+        pending = request._vote_groups_pending_adjust
+        self.assertEqual(len(pending), 1)
+        self.assertEqual(set(pending.values()[0][1]), {'g1'})
+        self.assertNotIn('one', groups.context.local_roles)
+        transaction.commit()
+        self.assertIn(security.ROLE_DISCUSS, groups.context.local_roles['one'])
+        self.assertNotIn(security.ROLE_DISCUSS, groups.context.local_roles['two'])
+        self.assertIs(request._vote_groups_pending_adjust, None)
+
+    def test_update_local_roles(self):
+        from voteit.core.models.meeting import Meeting
+        from voteit.core import security
+        from voteit.vote_groups.models import update_local_roles
+        meeting = Meeting()
+        meeting.local_roles.add('one', (security.ROLE_VOTER,), event=False)
+        meeting.local_roles.add('two', (security.ROLE_VOTER,), event=False)
+        changed = update_local_roles(
+            meeting,
+            add={'one': (security.ROLE_VOTER,), 'three': (security.ROLE_VOTER,)},
+            remove={'two': (security.ROLE_VOTER,), 'four': (security.ROLE_VOTER,)},
+        )
+        self.assertEqual(changed, 2)
+        self.assertEqual(set(security.find_role_userids(meeting, security.ROLE_VOTER)), {'one', 'three'})
+        self.assertEqual(update_local_roles(meeting, add={'one': (security.ROLE_VOTER,)}), 0)
+
+    def test_adjust_roles_only_writes_changes(self):
+        from voteit.core.models.meeting import Meeting
+        from voteit.core import security
+        from voteit.vote_groups.models import apply_adjust_meeting_roles
+
+        class _LocalRolesSpy(object):
+
+            def __init__(self, roles, calls):
+                self.roles = roles
+                self.calls = calls
+
+            def get(self, userid, default=None):
+                return self.roles.get(userid, default)
+
+            def __getitem__(self, userid):
+                return self.roles[userid]
+
+            def add(self, userid, roles, event=True):
+                self.calls.append(('add', userid, frozenset(roles)))
+                self.roles.add(userid, roles, event=event)
+
+            def remove(self, userid, roles, event=True):
+                self.calls.append(('remove', userid, frozenset(roles)))
+                self.roles.remove(userid, roles, event=event)
+
+            def send_event(self):
+                self.calls.append(('send_event',))
+                self.roles.send_event()
+
+        class _SpyMeeting(Meeting):
+            spy_calls = None
+
+            @property
+            def local_roles(self):
+                roles = super(_SpyMeeting, self).local_roles
+                if self.spy_calls is None:
+                    return roles
+                return _LocalRolesSpy(roles, self.spy_calls)
+
+        self.config.registry.registerAdapter(self._cut, provided=IVoteGroups)
+        request = testing.DummyRequest()
+        meeting = _SpyMeeting()
+        groups = self._cut(meeting, request)
+        groups.settings = {
+            'assigned_voter_roles': {security.ROLE_VIEWER, security.ROLE_DISCUSS},
+            'inactive_voter_roles': {security.ROLE_VIEWER},
+        }
+        self._initial_groups(groups)
+        apply_adjust_meeting_roles(meeting, request=request)
+        self.assertIn(security.ROLE_DISCUSS, meeting.local_roles['one'])
+        self.assertNotIn(security.ROLE_DISCUSS, meeting.local_roles['two'])
+        # Everything is already correct, so nothing is written and no event is sent
+        meeting.spy_calls = []
+        apply_adjust_meeting_roles(meeting, request=request)
+        apply_adjust_meeting_roles(meeting, groups['g1'], request=request)
+        self.assertEqual(meeting.spy_calls, [])
+        # Only the user that differs is written
+        meeting.spy_calls = None
+        meeting.local_roles.remove('one', (security.ROLE_DISCUSS,), event=False)
+        meeting.spy_calls = []
+        apply_adjust_meeting_roles(meeting, request=request)
+        self.assertEqual(meeting.spy_calls, [
+            ('add', 'one', frozenset([security.ROLE_DISCUSS])),
+            ('send_event',),
+        ])
+
 
 class VoteGroupTests(TestCase):
 
@@ -312,6 +588,26 @@ class VoteGroupTests(TestCase):
         self.assertEqual(set(group.primaries), {'two'})
         self.assertEqual(group.get_voters(), {'two'})
 
+    def test_role_sets(self):
+        group = self._mk_one()
+        group['one'] = 'primary'
+        self.assertEqual(set(group.primaries), {'one', 'two'})
+        self.assertEqual(set(group.standins), {'three'})
+        del group['two']
+        self.assertEqual(set(group.primaries), {'one'})
+        self.assertEqual(group.get_voters(), {'one'})
+
+    def test_counters(self):
+        group = self._mk_one()
+        self.assertEqual(len(group), 3)
+        self.assertEqual(group.count(ROLE_PRIMARY), 1)
+        self.assertEqual(group.count(ROLE_STANDIN), 2)
+        group['three'] = ROLE_PRIMARY
+        del group['one']
+        self.assertEqual(len(group), 2)
+        self.assertEqual(group.count(ROLE_PRIMARY), 2)
+        self.assertEqual(group.count(ROLE_STANDIN), 0)
+
     def test_assignments(self):
         group = self._mk_one()
         group.assignments['two'] = 'one'
@@ -321,6 +617,36 @@ class VoteGroupTests(TestCase):
         self.assertEqual(group.get_substitute_for('two'), 'one')
         self.assertIs(group.get_substitute_for('one'), None)
 
+    def test_assignments_reverse(self):
+        group = self._mk_one()
+        group.assignments['two'] = 'one'
+        with self.assertRaises(GroupPermissionsException):
+            group.assignments['four'] = 'one'
+        group.assignments['two'] = 'three'
+        self.assertEqual(group.get_primary_for('three'), 'two')
+        self.assertIs(group.get_primary_for('one'), None)
+        group.assignments.clear()
+        self.assertIs(group.get_primary_for('three'), None)
+
+    def test_assignments_resolve_conflict(self):
+        from voteit.vote_groups.models import Assignments
+        obj = Assignments()
+        old = {'data': {'a': 'x'}, 'substitutes': {'x': 'a'}}
+        committed = {'data': {'a': 'x', 'b': 'y'}, 'substitutes': {'x': 'a', 'y': 'b'}}
+        new = {'data': {}, 'substitutes': {}}
+        state = obj._p_resolveConflict(old, committed, new)
+        self.assertEqual(state['data'], {'b': 'y'})
+        self.assertEqual(state['substitutes'], {'y': 'b'})
+
+    def test_assignments_resolve_conflict_same_standin(self):
+        from ZODB.POSException import ConflictError
+        from voteit.vote_groups.models import Assignments
+        obj = Assignments()
+        old = {'data': {}, 'substitutes': {}}
+        committed = {'data': {'a': 'x'}, 'substitutes': {'x': 'a'}}
+        new = {'data': {'b': 'x'}, 'substitutes': {'x': 'b'}}
+        self.assertRaises(ConflictError, obj._p_resolveConflict, old, committed, new)
+
     def test_appstruct(self):
         group = self._mk_one()
         appstruct = group.appstruct()
@@ -362,3 +688,116 @@ class UserValidatedEmailIntegrationTests(TestCase):
         self.assertNotIn('hello@world.org', group.potential_members)
         # And added
         self.assertIn('jane', group)
+
+    def test_email_validated_subscriber_pending_index(self):
+        from arche.events import EmailValidatedEvent
+        from arche.resources import User
+        from voteit.core.models.meeting import Meeting
+        from voteit.vote_groups.models import VoteGroups
+        self.config.include('arche.testing')
+        self.config.include('voteit.core.testing_helpers.register_catalog')
+        root = bootstrap_and_fixture(self.config)
+        request = testing.DummyRequest()
+        apply_request_extensions(request)
+        request.root = root
+        self.config.begin(request)
+        root['m'] = m = Meeting()
+        groups = VoteGroups(m, request)
+        name = groups.new()
+        group = groups[name]
+        groups.update_from_appstruct({
+            'title': 'Group',
+            'description': '',
+            'members': [],
+            'potential_members': 'hello@world.org',
+        }, group)
+        self.assertEqual(root._vote_groups_pending_emails.get('Hello@World.org'), ((m.uid, name),))
+        root['users']['jane'] = user = User(email='hello@world.org', email_validated=True)
+        self.config.include('voteit.vote_groups.models')
+        self.config.registry.notify(EmailValidatedEvent(user))
+        self.assertIn('jane', group)
+        self.assertEqual(root._vote_groups_pending_emails.get('hello@world.org'), ())
+
+    def test_email_validated_other_spelling(self):
+        from arche.events import EmailValidatedEvent
+        from arche.resources import User
+        from voteit.core.models.meeting import Meeting
+        from voteit.vote_groups.models import VoteGroups
+        self.config.include('arche.testing')
+        self.config.include('voteit.core.testing_helpers.register_catalog')
+        root = bootstrap_and_fixture(self.config)
+        request = testing.DummyRequest()
+        apply_request_extensions(request)
+        request.root = root
+        self.config.begin(request)
+        root['m'] = m = Meeting()
+        groups = VoteGroups(m, request)
+        name = groups.new()
+        group = groups[name]
+        groups.update_from_appstruct({
+            'title': 'Group',
+            'description': '',
+            'members': [],
+            'potential_members': 'Hello@World.org',
+        }, group)
+        root['users']['jane'] = user = User(email='hello@world.org ', email_validated=True)
+        self.config.include('voteit.vote_groups.models')
+        self.config.registry.notify(EmailValidatedEvent(user))
+        self.assertIn('jane', group)
+        self.assertEqual(set(group.potential_members), set())
+        self.assertEqual(root._vote_groups_pending_emails.get('hello@world.org'), ())
+
+
+class PresentWithVoteGroupsVotersTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        from ZODB import DB
+        self.db = DB(None)
+        self.conn = self.db.open()
+
+    def tearDown(self):
+        import transaction
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+        testing.tearDown()
+
+    def _fixture(self):
+        import transaction
+        from BTrees.OOBTree import OOSet
+        from voteit.core.models.meeting import Meeting
+        from voteit.irl.models.interfaces import IMeetingPresence
+        from voteit.vote_groups.models import VoteGroups
+
+        class _Presence(object):
+            def __init__(self, meeting):
+                self.present_userids = meeting._present
+
+        self.config.registry.registerAdapter(_Presence, required=(IMeeting,), provided=IMeetingPresence)
+        self.config.registry.registerAdapter(VoteGroups, provided=IVoteGroups)
+        request = testing.DummyRequest()
+        self.config.begin(request)
+        self.conn.root()['m'] = m = Meeting()
+        m._present = OOSet(['one', 'two', 'three'])
+        groups = VoteGroups(m, request)
+        groups.new('g1')
+        groups['g1']['one'] = ROLE_PRIMARY
+        groups['g1']['two'] = ROLE_STANDIN
+        groups['g1']['three'] = ROLE_PRIMARY
+        transaction.commit()
+        return m, request
+
+    def test_get_voters_cached(self):
+        from voteit.vote_groups.models import PresentWithVoteGroupsVoters
+        m, request = self._fixture()
+        voters = PresentWithVoteGroupsVoters(m).get_voters(request=request)
+        self.assertEqual(voters, {'one', 'three'})
+        self.assertIs(PresentWithVoteGroupsVoters(m).get_voters(request=request), voters)
+
+    def test_presence_change_not_cached(self):
+        from voteit.vote_groups.models import PresentWithVoteGroupsVoters
+        m, request = self._fixture()
+        PresentWithVoteGroupsVoters(m).get_voters(request=request)
+        m._present.remove('three')
+        self.assertEqual(PresentWithVoteGroupsVoters(m).get_voters(request=request), {'one'})
@@ -0,0 +1,126 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+
+from pyramid import testing
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.request import apply_request_extensions
+from voteit.core.testing_helpers import bootstrap_and_fixture
+
+from voteit.vote_groups.interfaces import ROLE_PRIMARY
+from voteit.vote_groups.interfaces import ROLE_STANDIN
+
+
+class VoteGroupsViewJSONTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.include('arche.testing')
+        self.config.include('voteit.vote_groups.models')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _fixture(self):
+        from voteit.core.models.meeting import Meeting
+        from voteit.vote_groups.models import VoteGroups
+        self.root = bootstrap_and_fixture(self.config)
+        self.root['m'] = self.meeting = Meeting()
+        groups = VoteGroups(self.meeting, testing.DummyRequest())
+        for i in range(5):
+            name = groups.new('g%s' % i)
+            groups[name].title = 'Group %s' % i
+            for j in range(i + 1):
+                groups[name]['u%s' % j] = j == i and ROLE_PRIMARY or ROLE_STANDIN
+        return groups
+
+    def _view(self, **params):
+        from voteit.vote_groups.views import VoteGroupsView
+        request = testing.DummyRequest(params=params)
+        apply_request_extensions(request)
+        request.root = self.root
+        request.meeting = self.meeting
+        request.is_moderator = True
+        self.config.begin(request)
+        return VoteGroupsView(self.meeting, request)
+
+    def test_groups_json_pagination(self):
+        self._fixture()
+        result = self._view(page='2', per_page='2').groups_json()
+        self.assertEqual(result['total'], 5)
+        self.assertEqual(result['page'], 2)
+        self.assertEqual([x['name'] for x in result['items']], ['g2', 'g3'])
+        self.assertEqual(result['items'][0]['members_count'], 3)
+        result = self._view(page='3', per_page='2').groups_json()
+        self.assertEqual([x['name'] for x in result['items']], ['g4'])
+
+    def test_groups_json_sort_desc(self):
+        self._fixture()
+        result = self._view(sort='members', order='desc', per_page='2').groups_json()
+        self.assertEqual([x['name'] for x in result['items']], ['g4', 'g3'])
+
+    def test_groups_json_bad_params(self):
+        self._fixture()
+        self.assertRaises(HTTPBadRequest, self._view(sort='nope').groups_json)
+        self.assertRaises(HTTPBadRequest, self._view(page='x').groups_json)
+        self.assertRaises(HTTPBadRequest, self._view(per_page='').groups_json)
+
+    def test_groups_json_mine(self):
+        self._fixture()
+        self.config.testing_securitypolicy(userid='u3')
+        result = self._view(mine='1').groups_json()
+        self.assertEqual([x['name'] for x in result['items']], ['g3', 'g4'])
+
+    def test_group_json(self):
+        groups = self._fixture()
+        groups.assign_vote('u1', 'u0', groups['g1'], event=False)
+        result = self._view(vote_group='g1').group_json()
+        self.assertEqual(result['name'], 'g1')
+        self.assertEqual(result['assignments'], {'u1': 'u0'})
+        self.assertEqual({x['userid'] for x in result['members']}, {'u0', 'u1'})
+
+    def test_group_body(self):
+        self._fixture()
+        result = self._view(vote_group='g2').group_body()
+        self.assertEqual(result['vote_group'].name, 'g2')
+        self.assertEqual(len(result['rows']), 3)
+
+
+class CopyFromOtherMeetingFormTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.include('arche.testing')
+        self.config.include('voteit.vote_groups.models')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _fixture(self):
+        from voteit.core.models.meeting import Meeting
+        from voteit.vote_groups.models import VoteGroups
+        root = bootstrap_and_fixture(self.config)
+        request = testing.DummyRequest()
+        apply_request_extensions(request)
+        request.root = root
+        self.config.begin(request)
+        for (meeting_name, names) in (('a', ('g1', 'g2')), ('b', ('g2', 'g3'))):
+            root[meeting_name] = meeting = Meeting()
+            groups = VoteGroups(meeting, request)
+            for name in names:
+                groups.new(name)
+                groups[name]['%s_%s' % (meeting_name, name)] = ROLE_PRIMARY
+        root['m'] = meeting = Meeting()
+        request.meeting = meeting
+        return meeting, request
+
+    def test_copy_from_several_meetings(self):
+        from voteit.vote_groups.views import CopyFromOtherMeetingForm
+        meeting, request = self._fixture()
+        form = CopyFromOtherMeetingForm(meeting, request)
+        form.save_success({'meeting_names': ['a', 'b'], 'dry_run': True})
+        self.assertEqual(len(form.vote_groups), 0)
+        form.save_success({'meeting_names': ['a', 'b'], 'dry_run': False})
+        groups = form.vote_groups
+        self.assertEqual(set(groups.keys()), {'g1', 'g2', 'g3'})
+        self.assertEqual(dict(groups['g2'].items()), {'a_g2': ROLE_PRIMARY})
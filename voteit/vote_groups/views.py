@@ -1,18 +1,20 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import time
 from collections import Counter
 from typing import Iterable
 
-from arche.security import groupfinder
 from arche.views.base import BaseForm
 from arche.views.base import BaseView
 from arche.views.base import DefaultDeleteForm
 from arche.views.base import DefaultEditForm
 from pyramid.decorator import reify
+from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.httpexceptions import HTTPForbidden
 from pyramid.httpexceptions import HTTPFound
 from pyramid.httpexceptions import HTTPNotFound
+from pyramid.session import check_csrf_token
 from pyramid.traversal import resource_path
 from pyramid.view import view_config
 from repoze.catalog.query import Eq
@@ -33,41 +35,211 @@ except ImportError:
 
 from voteit.vote_groups import _
 from voteit.vote_groups.exceptions import GroupPermissionsException
+from voteit.vote_groups.exceptions import ImportFileError
+from voteit.vote_groups.exporter import iter_export_rows
+from voteit.vote_groups.exporter import iter_csv
+from voteit.vote_groups.exporter import iter_jsonl
 from voteit.vote_groups.fanstaticlib import vote_groups_all
+from voteit.vote_groups.importer import plan_import
+from voteit.vote_groups.importer import read_rows
+from voteit.vote_groups.instrumentation import timed
 from voteit.vote_groups.interfaces import IVoteGroups
+from voteit.vote_groups.interfaces import ROLE_PRIMARY
+from voteit.vote_groups.interfaces import ROLE_STANDIN
 from voteit.vote_groups.interfaces import VOTE_GROUP_ROLES
 from voteit.vote_groups.mixins import VoteGroupEditMixin
 from voteit.vote_groups.mixins import VoteGroupMixin
+from voteit.vote_groups.models import VoteGroup
 from voteit.vote_groups.models import apply_adjust_meeting_roles
+from voteit.vote_groups.models import is_active
+from voteit.vote_groups.models import update_local_roles
 
 
 _polls_ongoing_msg = _("Note! Polls ongoing within meeting!")
 
+AUTOLOAD_LIMIT = 5
+
+JSON_SORT_KEYS = {
+    'title': lambda g: g.title.lower(),
+    'members': lambda g: len(g),
+    'primaries': lambda g: g.count(ROLE_PRIMARY),
+    'potential_members': lambda g: len(g.potential_members),
+}
+
 
 class VoteGroupsView(BaseView, VoteGroupEditMixin):
 
     @view_config(name="vote_groups", context=IMeeting, renderer="templates/meeting_vote_groups.pt")
+    @timed('VoteGroupsView.delegations_view')
     def delegations_view(self):
         vote_groups_all.need()
         show_all = self.request.GET.get('show_all') == '1'
+        my_groups = self.vote_groups.vote_groups_for_user(self.request.authenticated_userid)
+        if self.request.is_moderator or show_all:
+            groups = self.vote_groups.sorted()
+        else:
+            groups = my_groups
         response = {
             'vote_groups': self.vote_groups,
-            'my_groups': self.vote_groups.vote_groups_for_user(self.request.authenticated_userid),
+            'my_groups': my_groups,
+            'groups': [self.group_summary(x) for x in groups],
+            # Few groups are loaded directly, the rest when they're expanded
+            'autoload': len(groups) <= AUTOLOAD_LIMIT,
             'role_choices': dict(VOTE_GROUP_ROLES),
             'has_qr': IPresenceQR is not None,
             'show_all': show_all,
         }
         return response
 
-    def is_voter(self, userid):
+    def group_summary(self, group):
+        # type: (VoteGroup) -> dict
+        """ Counts shown in the group header. Checked in is counted per member, since
+            check-ins through voteit.qr don't send any events that could update a counter.
+        """
+        index = self.vote_groups.index
+        checked_count = sum(1 for x in group.keys() if self.is_checked(x))
+        return {
+            'group': group,
+            'members_count': len(group),
+            'primaries_count': group.count(ROLE_PRIMARY),
+            'standins_count': group.count(ROLE_STANDIN),
+            'potential_count': len(group.potential_members),
+            'voters_count': index.count('voter_role', group.name),
+            'group_voters_count': index.count('voters', group.name),
+            'checked_count': checked_count,
+        }
+
+    def meeting_summary(self):
+        # type: () -> dict
+        """ Counts for all groups in the meeting. Users in several groups are counted once,
+            except for the role counts which are per membership.
+        """
+        index = self.vote_groups.index
+        return {
+            'members_count': index.count('members'),
+            'primaries_count': index.count(ROLE_PRIMARY),
+            'standins_count': index.count(ROLE_STANDIN),
+            'group_voters_count': index.count('voters'),
+        }
+
+    def group_rows(self, group):
+        # type: (VoteGroup) -> list
+        """ Compute everything the member table needs in one pass, so rendering doesn't
+            call back into the adapter for each member row.
+        """
+        vote_groups = self.vote_groups
+        group_voters = group.get_voters()
+        free_standins = vote_groups.get_free_standins(group)
+        rows = []
+        for (userid, role) in group.items():
+            is_voter = self.is_voter(userid)
+            is_checked = self.is_checked(userid)
+            substitute_for = group.get_primary_for(userid)
+            votes_for, votes_for_group = vote_groups.get_primary_for(userid)
+            voting_group = vote_groups.get_voting_group_for(userid)
+            voter_in_group = None
+            if role == ROLE_STANDIN and voting_group not in (None, group) and \
+                    voting_group.get(userid) == ROLE_PRIMARY:
+                voter_in_group = voting_group
+            rows.append({
+                'userid': userid,
+                'role': role,
+                'is_voter': is_voter,
+                'is_checked': is_checked,
+                'pending_voter': userid in group_voters and is_checked and not is_voter,
+                'assign_permission': vote_groups.get_assign_permission(userid, group),
+                'can_assign': bool(role == ROLE_PRIMARY and userid not in group.assignments and free_standins),
+                'substitute_for': substitute_for,
+                'substitute': group.get_substitute_for(userid),
+                'substitute_in_group': votes_for and not substitute_for and votes_for_group or None,
+                'voter_in_group': voter_in_group,
+            })
+        return rows
+
+    @view_config(name="_vote_group_body", context=IMeeting, permission=security.VIEW,
+                 renderer="templates/vote_group_body.pt")
+    @timed('VoteGroupsView.group_body')
+    def group_body(self):
+        """ Member table for one group, loaded when the group is expanded. """
+        return {
+            'vote_group': self.group,
+            'rows': self.group_rows(self.group),
+            'role_choices': dict(VOTE_GROUP_ROLES),
+            'has_qr': IPresenceQR is not None,
+        }
+
+    @view_config(name="vote_groups.json", context=IMeeting, permission=security.VIEW, renderer="json")
+    @timed('VoteGroupsView.groups_json')
+    def groups_json(self):
+        """ Paginated list of groups with summary counts.
+
+            GET params: page (from 1), per_page (max 100), sort (one of JSON_SORT_KEYS),
+            order (asc or desc) and mine=1 to only list groups the current user is a member of.
+        """
         try:
-            return self._cached_voters[userid]
-        except KeyError:
-            pass
-        except AttributeError:
-            self._cached_voters = {}
-        self._cached_voters[userid] = ROLE_VOTER in groupfinder(userid, self.request)
-        return self._cached_voters[userid]
+            page = max(int(self.request.GET.get('page', 1)), 1)
+            per_page = min(max(int(self.request.GET.get('per_page', 20)), 1), 100)
+        except ValueError:
+            raise HTTPBadRequest("page and per_page must be integers")
+        sort = self.request.GET.get('sort', 'title')
+        if sort not in JSON_SORT_KEYS:
+            raise HTTPBadRequest("sort must be one of: %s" % ", ".join(JSON_SORT_KEYS))
+        if self.request.GET.get('mine') == '1':
+            groups = self.vote_groups.vote_groups_for_user(self.request.authenticated_userid)
+        else:
+            groups = self.vote_groups.sorted()
+        if sort != 'title':
+            groups = sorted(groups, key=JSON_SORT_KEYS[sort])
+        if self.request.GET.get('order') == 'desc':
+            groups = list(reversed(groups))
+        start = (page - 1) * per_page
+        items = []
+        for group in groups[start:start + per_page]:
+            summary = self.group_summary(group)
+            del summary['group']
+            summary.update(
+                name=group.name,
+                title=group.title,
+                description=group.description,
+                url=self.request.resource_url(self.context, 'vote_group.json', query={'vote_group': group.name}),
+            )
+            items.append(summary)
+        return {
+            'total': len(groups),
+            'meeting': self.meeting_summary(),
+            'page': page,
+            'per_page': per_page,
+            'items': items,
+        }
+
+    @view_config(name="vote_group.json", context=IMeeting, permission=security.VIEW, renderer="json")
+    @timed('VoteGroupsView.group_json')
+    def group_json(self):
+        """ Members, roles and assignments of one group. """
+        group = self.group
+        members = []
+        for row in self.group_rows(group):
+            row = dict(row)
+            for k in ('substitute_in_group', 'voter_in_group'):
+                row[k] = row[k] and row[k].name or None
+            members.append(row)
+        return {
+            'name': group.name,
+            'title': group.title,
+            'description': group.description,
+            'members': members,
+            'assignments': dict(group.assignments.items()),
+            'potential_members_count': len(group.potential_members),
+        }
+
+    @reify
+    def voter_userids(self):
+        # type: () -> frozenset
+        """ Everyone with the voter role in this meeting, from one read of the local roles. """
+        return frozenset(security.find_role_userids(self.context, ROLE_VOTER))
+
+    def is_voter(self, userid):
+        return userid in self.voter_userids
 
     def is_checked(self, userid):
         return userid in self.pqr
@@ -79,6 +251,7 @@ class VoteGroupsView(BaseView, VoteGroupEditMixin):
         return ()
 
     @view_config(name="add_vote_group", context=IMeeting, permission=security.MODERATE_MEETING)
+    @timed('VoteGroupsView.add_vote_group')
     def add_vote_group(self):
         """ Add a new delegation and redirect to edit view.
         """
@@ -87,6 +260,7 @@ class VoteGroupsView(BaseView, VoteGroupEditMixin):
         return HTTPFound(location=url)
 
     @view_config(name="release_standin", context=IMeeting, permission=security.VIEW)
+    @timed('VoteGroupsView.release_standin')
     def release_standin(self):
         """ Release stand-in
         """
@@ -115,6 +289,7 @@ class VoteGroupsView(BaseView, VoteGroupEditMixin):
         context=IMeeting,
         permission=security.MODERATE_MEETING,
         renderer='json')
+    @timed('VoteGroupsView.save_roles')
     def save_roles(self):
         # TODO Load Schema(?), validate and save.
         group = self.group
@@ -139,11 +314,9 @@ class VoteGroupsView(BaseView, VoteGroupEditMixin):
                 'status': 'failed',
                 'error_message': self.request.localizer.translate(message),
             }
-        if changed:
-            for userid in changed:
-                role = self.request.POST[userid]
-                self.vote_groups.set_role(userid, role, group, event=False)
-            self.vote_groups.notify_changed(group)
+        for userid in changed:
+            role = self.request.POST[userid]
+            self.vote_groups.set_role(userid, role, group)
         return {
             'status': 'success',
             'changed_roles': len(changed)
@@ -163,6 +336,7 @@ class EditVoteGroupForm(DefaultEditForm, VoteGroupEditMixin):
     def appstruct(self):
         return self.group.appstruct()
 
+    @timed('EditVoteGroupForm.save_success')
     def save_success(self, appstruct):
         self.vote_groups.update_from_appstruct(appstruct, self.group)
         self.flash_messages.add(self.default_success)
@@ -187,6 +361,7 @@ class DeleteVoteGroupForm(DefaultDeleteForm, VoteGroupEditMixin):
                  default="Really delete vote group '${vote_group_title}'? This can't be undone",
                  mapping={'vote_group_title': self.vote_groups[self.group_name].title})
 
+    @timed('DeleteVoteGroupForm.delete_success')
     def delete_success(self, appstruct):
         msg = _("Deleted '${title}'",
                 mapping={'title': self.group.title})
@@ -241,6 +416,7 @@ class AssignVoteForm(DefaultEditForm, VoteGroupEditMixin):
         #Not used since you only assign new
         return {}
 
+    @timed('AssignVoteForm.save_success')
     def save_success(self, appstruct):
         try:
             self.vote_groups.assign_vote(self.for_user, appstruct['standin'], self.group)
@@ -294,23 +470,28 @@ class ApplyQRPermissionsForm(BaseForm, VoteGroupMixin):
                 userids = er.currently_set_voters()
                 er.new_register(userids)
 
+    @timed('ApplyQRPermissionsForm.save_success')
     def save_success(self, appstruct):
         groups = self.vote_groups
         qr = IPresenceQR(self.context)
-        new_voters = groups.get_voters().intersection(qr)
+        new_voters = groups.get_present_voters(qr)
         current_voters = security.find_role_userids(self.context, security.ROLE_VOTER)
         removed_voters = current_voters - new_voters
         added_voters = new_voters - current_voters
-        for userid in removed_voters:
-            self.context.del_groups(userid, (security.ROLE_VOTER,))
-        for userid in added_voters:
-            self.context.add_groups(userid, (security.ROLE_VOTER,))
-        msg = _("updated_voter_permissions_notice",
-                default = "Total voters: ${total}. Added ${added_count} new and removed ${removed_count}.",
+        start = time.time()
+        update_local_roles(
+            self.context,
+            add=dict((userid, (security.ROLE_VOTER,)) for userid in added_voters),
+            remove=dict((userid, (security.ROLE_VOTER,)) for userid in removed_voters),
+        )
+        msg = _("updated_voter_permissions_timing_notice",
+                default = "Total voters: ${total}. Added ${added_count} new and removed ${removed_count} "
+                          "in ${seconds} seconds.",
                 mapping = {
                     'total': len(new_voters),
                     'added_count': len(added_voters),
-                    'removed_count': len(removed_voters)
+                    'removed_count': len(removed_voters),
+                    'seconds': "%.2f" % (time.time() - start),
                 })
         self.flash_messages.add(msg)
         if appstruct['update_register']:
@@ -328,11 +509,25 @@ class CopyFromOtherMeetingForm(BaseForm, VoteGroupMixin):
     schema_name = 'copy'
     title = _("Copy groups from another meeting?")
 
+    @timed('CopyFromOtherMeetingForm.save_success')
     def save_success(self, appstruct):
-        meeting_name = appstruct['meeting_name']
-        from_meeting = self.request.root[meeting_name]
+        # On name collisions the first selected meeting wins
+        from_meetings = [self.request.root[x] for x in appstruct['meeting_names']]
         groups = self.vote_groups
-        copied_count = groups.copy_from_meeting(from_meeting)
+        if appstruct.get('dry_run'):
+            summary = groups.copy_from_meetings(from_meetings, dry_run=True)
+            msg = _("copy_dry_run_notice",
+                    default="Would copy ${groups} groups with ${members} members and "
+                            "${potential_members} potential members. ${skipped} groups already exist.",
+                    mapping={
+                        'groups': summary['groups'],
+                        'members': summary['members'],
+                        'potential_members': summary['potential_members'],
+                        'skipped': len(summary['skipped']),
+                    })
+            self.flash_messages.add(msg)
+            return HTTPFound(location=self.request.resource_url(self.context, '_copy_vote_groups'))
+        copied_count = groups.copy_from_meetings(from_meetings)['groups']
         if copied_count:
             msg = _("Copied ${count} groups", mapping = {'count': copied_count})
             self.flash_messages.add(msg, type='success')
@@ -373,6 +568,7 @@ class AddGroupTicketsForm(BaseForm, VoteGroupMixin):
             else:
                 counter['rejected'] += 1
 
+    @timed('AddGroupTicketsForm.add_success')
     def add_success(self, appstruct):
         groups = appstruct['groups']
         all_emails = self.vote_groups.get_emails(group_names=groups)
@@ -430,6 +626,7 @@ class SettingsForm(BaseForm, VoteGroupMixin):
         appstruct['apply_now'] = True
         return appstruct
 
+    @timed('SettingsForm.save_success')
     def save_success(self, appstruct):
         apply_now = appstruct.pop('apply_now')
         self.vote_groups.settings = appstruct
@@ -446,11 +643,113 @@ class SettingsForm(BaseForm, VoteGroupMixin):
         return HTTPFound(location = url)
 
 
+class ImportVoteGroupsView(BaseView, VoteGroupMixin):
+    """ Bulk import of groups, members and roles from a CSV or XLSX file.
+        The whole file is validated before anything is written.
+    """
+
+    @view_config(name="import_vote_groups",
+                 context=IMeeting,
+                 permission=security.MODERATE_MEETING,
+                 request_method='GET',
+                 renderer="templates/import_vote_groups.pt")
+    def form(self):
+        return {'result': None}
+
+    @view_config(name="import_vote_groups",
+                 context=IMeeting,
+                 permission=security.MODERATE_MEETING,
+                 request_method='POST',
+                 renderer="templates/import_vote_groups.pt")
+    @timed('ImportVoteGroupsView.upload')
+    def upload(self):
+        check_csrf_token(self.request)
+        result = self.process()
+        if result['status'] == 'success' and not result['dry_run']:
+            msg = _("import_success_notice",
+                    default="Imported ${members} members and ${potential_members} potential members "
+                            "to ${groups} groups.",
+                    mapping={
+                        'members': result['summary']['members'],
+                        'potential_members': result['summary']['potential_members'],
+                        'groups': result['summary']['new_groups'] + result['summary']['existing_groups'],
+                    })
+            self.flash_messages.add(msg, type='success')
+            return HTTPFound(location=self.request.resource_url(self.context, 'vote_groups'))
+        return {'result': result}
+
+    @view_config(name="vote_groups_import.json",
+                 context=IMeeting,
+                 permission=security.MODERATE_MEETING,
+                 request_method='POST',
+                 renderer="json")
+    @timed('ImportVoteGroupsView.upload_json')
+    def upload_json(self):
+        """ Same as upload. The token is accepted as csrf_token in POST or as an X-CSRF-Token header. """
+        check_csrf_token(self.request)
+        result = self.process()
+        if result['status'] != 'success':
+            self.request.response.status = 400
+        return result
+
+    def process(self):
+        # type: () -> dict
+        """ Expects the file as 'file' in POST. Nothing is written if 'dry_run' is set. """
+        upload = self.request.POST.get('file')
+        if getattr(upload, 'file', None) is None:
+            raise HTTPBadRequest("No file uploaded")
+        dry_run = self.request.POST.get('dry_run') in ('1', 'true', 'on')
+        translate = self.request.localizer.translate
+        try:
+            plan = plan_import(self.vote_groups, read_rows(upload.file, upload.filename or ''))
+        except ImportFileError as exc:
+            return {'status': 'failed', 'dry_run': dry_run, 'errors': [{'line': None, 'message': translate(exc.args[0])}]}
+        if plan.errors:
+            return {
+                'status': 'failed',
+                'dry_run': dry_run,
+                'errors': [{'line': lineno, 'message': translate(msg)} for (lineno, msg) in plan.errors],
+            }
+        summary = dry_run and plan.summary() or plan.apply()
+        return {'status': 'success', 'dry_run': dry_run, 'summary': summary}
+
+
+class ExportVoteGroupsView(BaseView, VoteGroupMixin):
+    """ Export of groups, roles, assignments and current voters, streamed row by row. """
+
+    @view_config(name="vote_groups_export.csv",
+                 context=IMeeting,
+                 permission=security.MODERATE_MEETING)
+    @timed('ExportVoteGroupsView.export_csv')
+    def export_csv(self):
+        return self.stream(iter_csv, 'text/csv', 'csv')
+
+    @view_config(name="vote_groups_export.jsonl",
+                 context=IMeeting,
+                 permission=security.MODERATE_MEETING)
+    @timed('ExportVoteGroupsView.export_jsonl')
+    def export_jsonl(self):
+        return self.stream(iter_jsonl, 'application/x-ndjson', 'jsonl')
+
+    def stream(self, serializer, content_type, extension):
+        response = self.request.response
+        response.content_type = content_type
+        response.charset = 'utf-8'
+        response.content_disposition = 'attachment; filename="vote_groups_%s.%s"' % (
+            self.context.__name__, extension)
+        response.app_iter = serializer(iter_export_rows(self.context, self.request))
+        return response
+
+
 def vote_groups_active(context, request, *args, **kw):
-    vote_groups = request.registry.queryMultiAdapter((request.meeting, request), IVoteGroups)
-    if vote_groups:
-        return bool(len(vote_groups))
-    return False
+    """ Does the current meeting have any vote groups? Reads the flag kept on the meeting,
+        once per request.
+    """
+    try:
+        return request._vote_groups_active
+    except AttributeError:
+        active = request._vote_groups_active = is_active(request.meeting)
+        return active
 
 
 def vote_groups_link(context, request, va, **kw):
@@ -497,6 +796,18 @@ def includeme(config):
         title=_("Copy from another meeting"),
         view_name='_copy_vote_groups',
     )
+    config.add_view_action(
+        control_panel_link,
+        'control_panel_vote_groups', 'import_vote_groups',
+        title=_("Import from file"),
+        view_name='import_vote_groups',
+    )
+    config.add_view_action(
+        control_panel_link,
+        'control_panel_vote_groups', 'export_vote_groups',
+        title=_("Export as CSV"),
+        view_name='vote_groups_export.csv',
+    )
     config.add_view_action(
         control_panel_link,
         'control_panel_vote_groups', 'add_group_tickets',